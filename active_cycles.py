@@ -0,0 +1,103 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+
+Bookkeeping of the arbitrage cycles currently open, so an opportunity that
+lasts over several datagrams is reported once when it opens and once when it
+closes, and is re-verified from its own edges instead of being searched for
+again.
+"""
+from clock import MICROS_PER_SECOND
+from parallel_search import canonical_cycle
+
+
+class ActiveCycles(object):
+    """
+    Open arbitrage cycles, keyed by their canonical vertex sequence and
+    indexed by their edges, so only the cycles through an edge that changed
+    are looked at again
+
+    >>> from bellman_ford import BellmanFord
+    >>> g = BellmanFord()
+    >>> now = 1_577_836_800_000_000
+    >>> for c1, c2, rate in [('GBP', 'USD', 1.25), ('USD', 'JPY', 100.0), \
+                             ('GBP', 'JPY', 130.0)]:
+    ...     g.add_to_graph([now, c1, c2, rate])
+    >>> cycles = ActiveCycles()
+    >>> cycles.open(['USD', 'GBP', 'JPY', 'USD'], now)
+    True
+    >>> cycles.open(['GBP', 'JPY', 'USD', 'GBP'], now)
+    False
+    >>> g.add_to_graph([now, 'GBP', 'JPY', 125.0])
+    >>> cycles.verify(g, [('GBP', 'JPY')], now + 2_000_000)
+    [(['GBP', 'JPY', 'USD', 'GBP'], 2.0)]
+    """
+    def __init__(self, tolerance=0.0001):
+        """
+        :param tolerance: Cycles must weigh less than -tolerance to stay open
+        """
+        self.tolerance = tolerance
+        self.active = {}  # Time each cycle opened by canonical cycle
+        self.by_edge = {}  # Set of open canonical cycles by directed edge
+
+    def open(self, cycle, now):
+        """
+        Records a cycle found by a search as open, unless it already is
+        :param cycle: Vertices of the cycle in order, ending with the first
+        :param now: Time the cycle was found, in microseconds since the epoch
+        :return: True if the cycle was not open before
+        """
+        key = canonical_cycle(cycle)
+        if key in self.active:
+            return False
+        self.active[key] = now
+        for edge in zip(key, key[1:]):
+            self.by_edge.setdefault(edge, set()).add(key)
+        return True
+
+    def verify(self, g, crosses, now):
+        """
+        Checks again the open cycles through either direction of the given
+        crosses, closing the ones that are no longer an arbitrage or have
+        lost an edge
+        :param g: Graph the cycles were found in
+        :param crosses: Iterable of (currency 1, currency 2) crosses that
+                        were requoted or went stale
+        :param now: Current time in microseconds since the epoch
+        :return: List of (cycle, seconds it was open) for the closed cycles
+        """
+        dirty = set()
+        for c1, c2 in crosses:
+            dirty.update(self.by_edge.get((c1, c2), ()))
+            dirty.update(self.by_edge.get((c2, c1), ()))
+
+        closed = []
+        for key in dirty:
+            if self.holds(g, key):
+                continue
+            opened = self.active.pop(key)
+            for edge in zip(key, key[1:]):
+                cycles = self.by_edge[edge]
+                cycles.discard(key)
+                if not cycles:
+                    del self.by_edge[edge]
+            closed.append((list(key), (now - opened) / MICROS_PER_SECOND))
+        return closed
+
+    def holds(self, g, cycle):
+        """
+        Checks whether a cycle is still an arbitrage, in O(cycle length)
+        :param g: Graph the cycle was found in
+        :param cycle: Vertices of the cycle in order, ending with the first
+        :return: True if every edge is still quoted and the cycle weighs less
+                 than -tolerance
+        """
+        edges = g.edges
+        weight = 0
+        for edge in zip(cycle, cycle[1:]):
+            if edge not in edges:
+                return False
+            weight += edges[edge]
+        return weight < -self.tolerance
@@ -4,9 +4,38 @@ This is free and unencumbered software released into the public domain.
 :Author: Ruifeng Wang
 :Version: Fall2020
 """
-from datetime import datetime
+import heapq
+from collections import deque
 from math import log
 
+import clock
+
+# Kinds of edge change counted in BellmanFord.dirty
+DIRTY_KINDS = ('added', 'improved', 'worsened', 'removed')
+
+
+class GraphVersion(object):
+    """
+    The graph as it was when BellmanFord.publish was called. The rates are
+    shared with the graph that published it rather than copied, and are never
+    written to again: the publishing graph copies a dictionary before its
+    next write to it. The edge weights follow from the rates, so a graph
+    adopting the version works out the ones that changed itself. Nothing is
+    meant to change a version once it is made.
+    """
+    def __init__(self, number, time, graph, changes):
+        """
+        :param number: Version number, counting up from 1
+        :param time: Time it was published, in microseconds since the epoch
+        :param graph: Signed rates as in BellmanFord.graph
+        :param changes: Set of the directed edges written since the previous
+                        version, None for the first
+        """
+        self.number = number
+        self.time = time
+        self.graph = graph
+        self.changes = changes
+
 
 class BellmanFord(object):
     """
@@ -17,20 +46,53 @@ class BellmanFord(object):
     Additionally, it is checked if the negative edge is included in a cycle
     that leads back to the original currency.
     """
-    def __init__(self):
+    versioned = True  # Whether publish and adopt can be used
+
+    def __init__(self, stale_after=1.5, clock_source=None):
         """
         Constructs a BellmanFord object that contains all the properties to
         store a graph and run the Bellman-Ford algorithm
         :param self:
+        :param stale_after: Seconds after which a quote is stale
+        :param clock_source: Clock stale quotes are judged by (see clock.py),
+                             the system clock if not given
         :return:
         """
         self.graph = {}  # Stores the graph
-        self.last_quoted = {}  # Keeps tracks of when the quote was added
+        self.edges = {}  # Directed edge weights (-log rate) keyed by (c1, c2)
+        # Timestamp of the latest quote of each cross, either way round,
+        # keyed by the cross in sorted order
+        self.last_quoted = {}
+        self.stale_after = clock.seconds_to_micros(stale_after)
+        self.clock = clock_source or clock.SYSTEM
+        # Min-heap of (timestamp, (c1, c2)) for every quote added, timestamps
+        # in microseconds. Entries for quotes that have since been quoted
+        # again are skipped when popped.
+        self.expiry = []
+
+        # State kept between incremental runs of find_negative_cycle
+        self.potential = {}  # Distances from the virtual source
+        self.potential_prev = {}  # Predecessors matching the potential
+        self.potential_valid = False  # False until a run finds no cycle
+        self.changed_edges = set()  # Edges added or made cheaper since then
+        # Edges of each cycle the potential was settled around (see
+        # settle_around), None when it holds for every edge
+        self.settled = None
+        self.excluded = set()  # Edges of the settled cycles
+        # Counts of the edge changes since the last take_dirty
+        self.dirty = dict.fromkeys(DIRTY_KINDS, 0)
+
+        # Versions published (see publish) or adopted (see adopt)
+        self.version = 0
+        self.shared = False  # Whether graph belongs to a version
+        self.shared_rows = set()  # Rows of graph that belong to a version
+        self.touched = None  # Edges written since the last version
 
     def add_to_graph(self, message):
         """
         Deciphers and adds a quote to the graph
-        :param message: Quote to be added to graph (list format)
+        :param message: Quote to be added to graph (list format), with its
+                        timestamp in microseconds since the epoch
         :return: None
         """
         timestamp = message[0]
@@ -39,42 +101,267 @@ class BellmanFord(object):
         weight = message[3]
         combined = (c1, c2)
 
-        self.last_quoted[combined] = timestamp
+        self.last_quoted[combined if c1 < c2 else (c2, c1)] = timestamp
+        heapq.heappush(self.expiry, (timestamp, combined))
 
         # Storing the weight without converting using log base 10
         # The conversion is done in the Bellman-Ford algorithm
         # Reasoning is to know which direction I'm heading on the currency graph
         # Positive is from c1 to c2, negative is from c2 to c1
-        if c1 not in self.graph.keys():
-            self.graph[c1] = {c2: weight}
-        else:
-            self.graph[c1][c2] = weight
-        if c2 not in self.graph.keys():
-            self.graph[c2] = {c1: -weight}
-        else:
-            self.graph[c2][c1] = -weight
+        self._writable_row(c1)[c2] = weight
+        self._writable_row(c2)[c1] = -weight
+
+        # The edge store holds the weights the algorithm actually relaxes on,
+        # so the logarithm is only taken once per quote rather than once per
+        # edge on every pass of Bellman-Ford
+        log_rate = log(weight, 10)
+        self._set_edge(c1, c2, -log_rate)
+        self._set_edge(c2, c1, log_rate)
 
-    def remove_stale_quotes(self):
+    def _set_edge(self, c1, c2, weight):
         """
-        Removes stale quotes (older than 1.5 seconds) from the graph
+        Stores the weight of the directed edge from c1 to c2 and keeps track
+        of what an incremental run needs to look at again
+        :param c1: Currency the edge leaves
+        :param c2: Currency the edge enters
+        :param weight: -log base 10 of the rate from c1 to c2
         :return: None
         """
-        if self.last_quoted:
-            for key, value in list(self.last_quoted.items()):
-                if (datetime.utcnow() - value).total_seconds() > 1.5:
-                    curr1 = key[0]
-                    curr2 = key[1]
-
-                    del self.last_quoted[key]
-                    # Was getting key error when trying to remove from the graph
-                    # but this try-except solved it
-                    try:
-                        del self.graph[curr1][curr2]
-                        del self.graph[curr2][curr1]
-                    except KeyError:
-                        continue
-                    print('removing stale quote for (\'' + curr1 + '\', \''
-                          + curr2 + '\')')
+        edge = (c1, c2)
+        old_weight = self.edges.get(edge)
+        self.edges[edge] = weight
+        if self.touched is not None:
+            self.touched.add(edge)
+        self._track_change(c1, c2, old_weight, weight)
+
+    def _writable_row(self, currency):
+        """
+        Gets the rates out of a currency for writing to, making it if the
+        currency is new. Whatever belongs to a published version is copied
+        first: graph on the first write after publish, and each row on its
+        first write.
+        :param currency: Currency the rates leave
+        :return: Dictionary of signed rate by currency, as in graph
+        """
+        if self.shared:
+            self.graph = dict(self.graph)
+            self.shared = False
+        row = self.graph.get(currency)
+        if row is None:
+            row = self.graph[currency] = {}
+        elif currency in self.shared_rows:
+            row = self.graph[currency] = dict(row)
+            self.shared_rows.discard(currency)
+        return row
+
+    def _track_change(self, c1, c2, old_weight, weight):
+        """
+        Records a change to the weight of an edge in the dirty summary and in
+        what an incremental run needs to look at again
+        :param c1: Currency the edge leaves
+        :param c2: Currency the edge enters
+        :param old_weight: Weight before, None if the edge is new
+        :param weight: Weight after
+        :return: None
+        """
+        if old_weight is None:
+            self.dirty['added'] += 1
+        elif weight < old_weight:
+            self.dirty['improved'] += 1
+        elif weight > old_weight:
+            self.dirty['worsened'] += 1
+        if old_weight is None or weight < old_weight:
+            # Only a new or cheaper edge can break the stored potential
+            self.changed_edges.add((c1, c2))
+        elif weight > old_weight and self.potential_prev.get(c2) == c1:
+            # The predecessor no longer describes a path through this edge
+            self.potential_prev[c2] = None
+
+    def _remove_edge(self, c1, c2):
+        """
+        Removes the directed edge from c1 to c2 from the edge store
+        :param c1: Currency the edge leaves
+        :param c2: Currency the edge enters
+        :return: None
+        """
+        self.edges.pop((c1, c2), None)
+        if self.touched is not None:
+            self.touched.add((c1, c2))
+        self._track_removal(c1, c2)
+
+    def _track_removal(self, c1, c2):
+        """
+        Records the removal of an edge in the dirty summary and in what an
+        incremental run needs to look at again
+        :param c1: Currency the edge left
+        :param c2: Currency the edge entered
+        :return: None
+        """
+        self.dirty['removed'] += 1
+        self.changed_edges.discard((c1, c2))
+        if self.potential_prev.get(c2) == c1:
+            self.potential_prev[c2] = None
+
+    def remove_stale_quotes(self, now=None):
+        """
+        Removes stale quotes (older than stale_after seconds) from the graph.
+        Only quotes that have actually expired are looked at, by popping them
+        off the expiry heap in timestamp order. Both edges of a cross share
+        one quote, so they go once the latest quote of the cross either way
+        round is stale.
+        :param now: Current time in microseconds since the epoch, read from
+                    the clock if not given
+        :return: List of the crosses removed, as (c1, c2) tuples
+        """
+        removed = []
+        expiry = self.expiry
+        if not expiry:
+            return removed
+        if now is None:
+            now = self.clock.now()
+        cutoff = now - self.stale_after
+
+        while expiry and expiry[0][0] < cutoff:
+            timestamp, key = heapq.heappop(expiry)
+            curr1 = key[0]
+            curr2 = key[1]
+            cross = key if curr1 < curr2 else (curr2, curr1)
+            # Skip entries for crosses quoted again (either way round) since
+            if self.last_quoted.get(cross) != timestamp:
+                continue
+
+            del self.last_quoted[cross]
+            # An adopted version may not have the cross
+            if curr2 not in self.graph.get(curr1, ()):
+                continue
+            del self._writable_row(curr1)[curr2]
+            del self._writable_row(curr2)[curr1]
+            self._remove_edge(curr1, curr2)
+            self._remove_edge(curr2, curr1)
+            removed.append(key)
+        return removed
+
+    def publish(self, now=None):
+        """
+        Makes a version of the graph as it is now, which another thread can
+        search while quotes keep being added here. Nothing is copied up
+        front: the version takes the current rates and this graph copies the
+        dictionary of rows, and each row, before it next writes to it. The
+        edge weights are not part of a version, so publishing and the first
+        quote after it cost O(vertices), and each row written to costs a copy
+        of that row.
+
+        >>> g = BellmanFord()
+        >>> g.add_to_graph([0, 'GBP', 'USD', 1.25])
+        >>> first = g.publish(0)
+        >>> g.add_to_graph([1, 'USD', 'JPY', 100.0])
+        >>> second = g.publish(1)
+        >>> sorted(first.graph), second.number, sorted(second.changes)
+        (['GBP', 'USD'], 2, [('JPY', 'USD'), ('USD', 'JPY')])
+        >>> first.graph['USD'] is second.graph['USD'], \
+            first.graph['GBP'] is second.graph['GBP']
+        (False, True)
+        >>> search = BellmanFord()
+        >>> len(search.adopt(second))
+        2
+        >>> search.add_to_graph([2, 'GBP', 'USD', 1.5])
+        >>> second.graph['GBP'], search.graph['GBP']
+        ({'USD': 1.25}, {'USD': 1.5})
+
+        :param now: Time to publish it as, in microseconds since the epoch,
+                    read from the clock if not given
+        :return: GraphVersion
+        """
+        if now is None:
+            now = self.clock.now()
+        self.version += 1
+        changes = self.touched
+        self.touched = set()
+        self.shared = True
+        self.shared_rows = set(self.graph)
+        return GraphVersion(self.version, now, self.graph, changes)
+
+    def adopt(self, version):
+        """
+        Makes a version published by another graph the one searched from now
+        on, sharing its rates, which are only read here. The weights of the
+        edges that differ from the version adopted before are worked out from
+        the rates, and tracked the same way as quotes added here, so
+        incremental runs and search_needed carry on across versions. When
+        versions were skipped, the edges of every row that is not the same
+        dictionary as before are compared, as a row is copied before it is
+        written to. Here every third version of a random stream is adopted,
+        as by a search thread that falls behind, and each one adopted must
+        have the publishing graph's edges and the full run's result, and no
+        version may change after it is published:
+
+        >>> from benchmark import feed_stream
+        >>> from dense_bellman_ford import DenseBellmanFord
+        >>> full, store = BellmanFord(), BellmanFord()
+        >>> searchers = BellmanFord(), DenseBellmanFord()
+        >>> mismatches, previous = 0, None
+        >>> for i, quotes in enumerate(feed_stream(
+        ...         (full, store), 12, 1000, arbitrage_rate=0.01,
+        ...         volatility=1e-6)):
+        ...     if previous and previous[0].graph != previous[1]:
+        ...         mismatches += 1
+        ...     version = store.publish()
+        ...     previous = version, {currency: dict(row) for currency, row
+        ...                          in version.graph.items()}
+        ...     if i % 3 == 0:
+        ...         expected = bool(full.find_negative_cycle()[3])
+        ...         for g in searchers:
+        ...             crosses = g.adopt(version)
+        ...             mismatches += dict(g.edges) != store.edges
+        ...             mismatches += bool(g.find_negative_cycle(
+        ...                 incremental=True)[3]) != expected
+        >>> mismatches
+        0
+
+        :param version: GraphVersion to search
+        :return: Set of the crosses that changed, as (c1, c2) tuples with
+                 each cross once in one direction or the other
+        """
+        graph = version.graph
+        if version.changes is not None and version.number == self.version + 1:
+            candidates = version.changes
+        else:
+            old_graph = self.graph
+            candidates = set()
+            for currency, row in graph.items():
+                old_row = old_graph.get(currency, {})
+                if row is not old_row:
+                    candidates.update((currency, other)
+                                      for other in row.keys() | old_row.keys())
+        edges = self.edges
+        crosses = set()
+        for edge in candidates:
+            old_weight = edges.get(edge)
+            rate = graph.get(edge[0], {}).get(edge[1])
+            if rate is None:
+                weight = None
+            elif rate > 0:
+                weight = -log(rate, 10)
+            else:
+                # The reverse of a quote, see add_to_graph
+                weight = log(-rate, 10)
+            if weight == old_weight:
+                continue
+            if weight is None:
+                del edges[edge]
+                self._track_removal(*edge)
+            else:
+                edges[edge] = weight
+                self._track_change(edge[0], edge[1], old_weight, weight)
+            if (edge[1], edge[0]) not in crosses:
+                crosses.add(edge)
+        self.graph = graph
+        # The rates belong to the version, so they are copied before any
+        # write here, as after publish
+        self.shared = True
+        self.shared_rows = set(graph)
+        self.version = version.number
+        return crosses
 
     def get_vertices(self):
         """
@@ -92,6 +379,30 @@ class BellmanFord(object):
         """
         return self.graph[curr1][curr2]
 
+    def get_conversion_rate(self, curr1, curr2):
+        """
+        Gets how much of curr2 one unit of curr1 converts to, undoing the sign
+        convention of the stored exchange rate
+        :param curr1: Currency converted from
+        :param curr2: Currency converted to
+        :return: Conversion rate from curr1 to curr2
+        """
+        rate = self.graph[curr1][curr2]
+        if rate > 0:
+            return rate
+        return 1 / abs(rate)
+
+    def cycle_return(self, cycle):
+        """
+        Gross return of converting around a cycle, 1.01 meaning 1% profit
+        :param cycle: Vertices of the cycle in order, ending with the first
+        :return: Product of the conversion rates along the cycle
+        """
+        value = 1
+        for i in range(len(cycle) - 1):
+            value *= self.get_conversion_rate(cycle[i], cycle[i + 1])
+        return value
+
     def shortest_paths(self, start_vertex, tolerance=0.0001):
         """
         Find the shortest paths (sum of edge weights) from start_vertex to every
@@ -133,6 +444,7 @@ class BellmanFord(object):
         negative_edge = None
         dist = {}
         prev = {}
+        edges = self.edges
 
         # Start by initializing the dist to all vertices as infinity
         for vertex in self.graph.keys():
@@ -142,73 +454,538 @@ class BellmanFord(object):
 
         # This relaxes the edges, finding the shortest distance from the
         # start vertex to every other vertex (stored in dist)
+        # The weights are already -log base 10 of the rate in the direction of
+        # the edge, so this loop only adds and compares
         for _ in range(len(self.graph.keys()) - 1):
-            for c1, edges in self.graph.items():
-                for c2, weight in edges.items():
-                    # If the weight is greater than 0, then we are going from c1
-                    # to c2, so we use -log base 10, otherwise we are going from
-                    # c2 to c1 and use log base 10 (must take absolute value of
-                    # the weight since we stored the -)
-                    if weight > 0:
-                        weight = -log(weight, 10)
-                    else:
-                        weight = log(abs(weight), 10)
-                    if dist[c1] != float("Inf") and dist[c1] + \
-                            weight < dist[c2]:
-                        if dist[c2] - (dist[c1] + weight) >= tolerance:
-                            dist[c2] = dist[c1] + weight
-                            prev[c2] = c1
+            for (c1, c2), weight in edges.items():
+                if dist[c1] + weight < dist[c2]:
+                    if dist[c2] - (dist[c1] + weight) >= tolerance:
+                        dist[c2] = dist[c1] + weight
+                        prev[c2] = c1
 
         for key in dist:
             if dist[key] == float("Inf"):
                 prev[key] = None
 
-        found = False
         potential_cycle = []
 
         # Additional step to find if a negative edge exists
-        for c1, edges in self.graph.items():
-            for c2, weight in edges.items():
-                potential_cycle.clear()
-                # If the weight is greater than 0, then we are going from c1
-                # to c2, so we use -log base 10, otherwise we are going from
-                # c2 to c1 and use log base 10 (must take absolute value of
-                # the weight since we stored the -)
-                if weight > 0:
-                    weight = -log(weight, 10)
-                else:
-                    weight = log(abs(weight), 10)
-                if dist[c1] != float("Inf") and dist[c1] + \
-                        weight < dist[c2]:
-
+        for (c1, c2), weight in edges.items():
+            if dist[c1] + weight < dist[c2]:
+                cycle = self._trace_cycle(prev, c2)
+                if cycle:
                     negative_edge = (c2, c1)
+                    potential_cycle = cycle
+                    break
+
+        return dist, prev, negative_edge, potential_cycle
+
+    def take_dirty(self):
+        """
+        Gets the counts of the edges added, improved (made cheaper), worsened
+        and removed since the last call, and starts counting again
+        :return: Dictionary of count by kind of change, keyed as DIRTY_KINDS
+        """
+        dirty = self.dirty
+        self.dirty = dict.fromkeys(DIRTY_KINDS, 0)
+        return dirty
+
+    def potential_holds(self, tolerance=0.0001):
+        """
+        Checks whether the distances of the last run that found no cycle are
+        still consistent, to within tolerance, with every edge added or made
+        cheaper since. If so an incremental run would relax nothing, so there
+        is still no negative cycle and detection can be skipped. Costs one
+        check per such edge. Distances settled around open cycles (see
+        settle_around) only hold while each of those cycles still weighs
+        less than -tolerance, which costs one check per edge of them.
+
+        Gating searches on it (see search_needed), settling around each
+        cycle found, never skips a search that would have found arbitrage
+        or leaves a closed cycle looking open:
 
-                    ending_vertex = negative_edge[0]
-
-                    potential_cycle = [ending_vertex]
-                    curr_vertex = prev[ending_vertex]
-
-                    # This loop checks if the negative edge is a part of
-                    # a cycle according to the prev
-                    # If it is, the found variable is flipped to True
-                    while True:
-                        if ending_vertex == curr_vertex:
-                            potential_cycle.append(curr_vertex)
-                            found = True
-                            break
-                        elif curr_vertex in potential_cycle:
-                            found = False
-                            break
-                        else:
-                            potential_cycle.append(curr_vertex)
-                            curr_vertex = prev[curr_vertex]
-            # Found the cycle
-            if found:
+        >>> from benchmark import feed_stream
+        >>> full, gated = BellmanFord(), BellmanFord()
+        >>> found, wrongly_skipped = False, 0
+        >>> for quotes in feed_stream((full, gated), 12, 1000,
+        ...                           arbitrage_rate=0.01, volatility=1e-6):
+        ...     expected = bool(full.find_negative_cycle()[3])
+        ...     if gated.search_needed(gated.take_dirty(), found):
+        ...         cycle = gated.find_negative_cycle(incremental=True)[3]
+        ...         found = bool(cycle)
+        ...         if found:
+        ...             others = gated.settle_around([cycle[::-1]])
+        ...     elif expected != found:
+        ...         wrongly_skipped += 1
+        >>> wrongly_skipped
+        0
+
+        :param tolerance: Tolerance of the detection run
+        :return: True if the last run's result of no cycle still holds
+        """
+        if not self.potential_valid:
+            return False
+        dist = self.potential
+        edges = self.edges
+        if self.settled is not None:
+            # The edges left out only keep their cycles negative while the
+            # cycles stay open
+            for cycle in self.settled:
+                weight = 0
+                for edge in cycle:
+                    if edge not in edges:
+                        return False
+                    weight += edges[edge]
+                if weight >= -tolerance:
+                    return False
+        excluded = self.excluded
+        for c1, c2 in self.changed_edges:
+            if (c1, c2) in excluded:
+                continue
+            if c1 not in dist or c2 not in dist:
+                return False
+            if dist[c2] - (dist[c1] + edges[(c1, c2)]) >= tolerance:
+                return False
+        self.changed_edges.clear()
+        return True
+
+    def search_needed(self, dirty, found, tolerance=0.0001):
+        """
+        Decides whether the result of the last search could have changed.
+        Without any edge change it cannot. If the last search found nothing,
+        only an added or cheaper edge can make a cycle, and not even one of
+        those if the stored distances still hold (see potential_holds). If it
+        found cycles, the search is only skipped once the distances have
+        been settled around them (see settle_around), while they still hold
+        and no other edge could have made a new cycle.
+        :param dirty: Summary of the edge changes since the last search, from
+                      take_dirty
+        :param found: Whether the last search found a cycle
+        :param tolerance: Tolerance of the detection run
+        :return: True if a search has to be run
+        """
+        if not any(dirty.values()):
+            return False
+        if found:
+            return self.settled is None or not self.potential_holds(tolerance)
+        if not dirty['added'] and not dirty['improved']:
+            return False
+        return not self.potential_holds(tolerance)
+
+    def settle_around(self, cycles, tolerance=0.0001, limit=4):
+        """
+        Works out distances from the virtual source that hold for every edge
+        outside the given open cycles, so that a search can be skipped while
+        those cycles stay open and nothing else could have made a new cycle
+        (see search_needed). Other cycles through the edges of the ones left
+        out are not looked for until one of them closes. A negative cycle in
+        the rest of the graph, which a search reporting one cycle at a time
+        would not have reported, is left out as well and returned. Costs a
+        run of Bellman-Ford over the rest of the graph for each.
+
+        >>> g = BellmanFord()
+        >>> for c1, c2, rate in [('GBP', 'USD', 1.25), ('USD', 'JPY', 100.0),
+        ...                      ('GBP', 'JPY', 130.0), ('EUR', 'CHF', 1.1),
+        ...                      ('CHF', 'AUD', 1.5), ('EUR', 'AUD', 1.7)]:
+        ...     g.add_to_graph([0, c1, c2, rate])
+        >>> cycle = g.find_negative_cycle()[3][::-1]
+        >>> cycle
+        ['GBP', 'JPY', 'USD', 'GBP']
+        >>> g.settle_around([cycle])
+        [['EUR', 'AUD', 'CHF', 'EUR']]
+        >>> g.add_to_graph([1, 'GBP', 'USD', 1.2501])
+        >>> g.search_needed(g.take_dirty(), True)
+        False
+        >>> g.add_to_graph([2, 'GBP', 'JPY', 125.0])
+        >>> g.search_needed(g.take_dirty(), True)
+        True
+
+        :param cycles: Open cycles, each listing its vertices in order and
+                       ending with the first
+        :param tolerance: Tolerance of the detection run
+        :param limit: Most other cycles to leave out before giving up
+        :return: List of the other cycles left out, in the same form, or
+                 None if there were more than limit and no distances were
+                 kept
+        """
+        settled = [list(zip(cycle, cycle[1:])) for cycle in cycles]
+        excluded = {edge for cycle in settled for edge in cycle}
+        others = []
+        while len(others) <= limit:
+            rest = [(edge, weight) for edge, weight in self.edges.items()
+                    if edge not in excluded]
+            dist = dict.fromkeys(self.graph.keys(), 0)
+            prev = dict.fromkeys(self.graph.keys())
+            for _ in range(len(dist)):
+                relaxed = False
+                for (c1, c2), weight in rest:
+                    if dist[c2] - (dist[c1] + weight) >= tolerance:
+                        dist[c2] = dist[c1] + weight
+                        prev[c2] = c1
+                        relaxed = True
+                if not relaxed:
+                    self.potential = dist
+                    self.potential_prev = prev
+                    self.potential_valid = True
+                    self.changed_edges.clear()
+                    self.settled = settled
+                    self.excluded = excluded
+                    return others
+            cycle = []
+            for (c1, c2), weight in rest:
+                if dist[c2] - (dist[c1] + weight) >= tolerance:
+                    prev[c2] = c1
+                    cycle = self._walk_to_cycle(prev, c2, len(dist))
+                    if cycle:
+                        break
+            if not cycle:
                 break
-        # Did not find the cycle, so we will mark negative_edge as None and
-        # and empty the cycle
-        if not found:
-            negative_edge = None
-            potential_cycle.clear()
+            cycle.reverse()
+            others.append(cycle)
+            settled.append(list(zip(cycle, cycle[1:])))
+            excluded.update(settled[-1])
+        return None
 
-        return dist, prev, negative_edge, potential_cycle
+    def find_negative_cycle(self, tolerance=0.0001, incremental=False):
+        """
+        Looks for any negative cycle in the graph with a single run of
+        Bellman-Ford. Instead of starting from one vertex, every distance
+        starts at 0, as if a virtual source had a 0 weight edge to each
+        vertex, so a cycle anywhere in the graph is found in one run. The run
+        stops early as soon as a pass relaxes nothing, which is the usual case
+        when there is no arbitrage.
+
+        Tolerance is used the same way as in shortest_paths.
+
+        With incremental set, the distances of the last run that found no
+        cycle are kept and only repaired from the edges that were added or
+        became cheaper since then, as removed or more expensive edges cannot
+        create a cycle. The repair is a queue based relaxation (SPFA) seeded
+        from those edges, so its cost follows the size of the change rather
+        than the size of the graph. A full run is only done the first time,
+        after a cycle was found and when the repair runs into one, so any
+        cycle reported is the one a full run reports.
+
+        Whether a cycle is found at all depends on the tolerance: a run that
+        finds none leaves every cycle of k edges weighing more than
+        -k * tolerance, and a cycle found weighs at most -tolerance. Cycles
+        in between may be found by a full run and missed by a repair, which
+        starts from different distances. Against full runs over a random
+        stream of quotes, repairs report the same results but for such
+        misses:
+
+        >>> from benchmark import feed_stream, cycle_weight
+        >>> full, repaired = BellmanFord(), BellmanFord()
+        >>> mismatches = 0
+        >>> for quotes in feed_stream((full, repaired), 12, 1000):
+        ...     expected = full.find_negative_cycle()[2:]
+        ...     result = repaired.find_negative_cycle(incremental=True)[2:]
+        ...     cycle, missed = result[1], expected[1]
+        ...     if cycle and cycle_weight(full, cycle) > -0.0001:
+        ...         mismatches += 1
+        ...     elif result != expected and (cycle or cycle_weight(
+        ...             full, missed) <= -(len(missed) - 1) * 0.0001):
+        ...         mismatches += 1
+        >>> mismatches
+        0
+
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed
+        :param incremental: repair the distances of the last run instead of
+                            starting over
+        :return: distance, predecessor, negative_cycle, cycle in the same
+                 form as shortest_paths, with distances measured from the
+                 virtual source and negative_cycle an edge (u, v) of the cycle
+        """
+        if incremental and self.potential_valid:
+            return self._repair_potential(tolerance)
+
+        dist = dict.fromkeys(self.graph.keys(), 0)
+        prev = dict.fromkeys(self.graph.keys())
+        edges = self.edges
+        self.changed_edges.clear()
+        self.potential_valid = False
+        self.settled = None
+        self.excluded = set()
+
+        for _ in range(len(dist)):
+            relaxed = False
+            for (c1, c2), weight in edges.items():
+                if dist[c2] - (dist[c1] + weight) >= tolerance:
+                    dist[c2] = dist[c1] + weight
+                    prev[c2] = c1
+                    relaxed = True
+            # Nothing changed, so the distances are final and there is no
+            # negative cycle
+            if not relaxed:
+                self.potential = dist
+                self.potential_prev = prev
+                self.potential_valid = True
+                return dist, prev, None, []
+
+        # Still relaxing after as many passes as there are vertices, so there
+        # must be a negative cycle behind a vertex that can still be relaxed
+        for (c1, c2), weight in edges.items():
+            if dist[c2] - (dist[c1] + weight) >= tolerance:
+                prev[c2] = c1
+                cycle = self._walk_to_cycle(prev, c2, len(dist))
+                if cycle:
+                    return dist, prev, (cycle[1], cycle[0]), cycle
+        return dist, prev, None, []
+
+    def _repair_potential(self, tolerance):
+        """
+        Relaxes outwards from the edges changed since the last run until the
+        stored distances are consistent again or a negative cycle shows up
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed
+        :return: Same as find_negative_cycle
+        """
+        dist = self.potential
+        prev = self.potential_prev
+        graph = self.graph
+        edges = self.edges
+
+        for vertex in graph:
+            if vertex not in dist:
+                dist[vertex] = 0
+                prev[vertex] = None
+
+        seeds = self.changed_edges
+        if self.settled is not None:
+            # The edges left out by settle_around are looked at again too
+            seeds = seeds | {edge for edge in self.excluded if edge in edges}
+            self.settled = None
+            self.excluded = set()
+        queue = deque()
+        queued = set()
+        for c1, c2 in seeds:
+            if dist[c2] - (dist[c1] + edges[(c1, c2)]) >= tolerance:
+                dist[c2] = dist[c1] + edges[(c1, c2)]
+                prev[c2] = c1
+                if c2 not in queued:
+                    queue.append(c2)
+                    queued.add(c2)
+        self.changed_edges.clear()
+
+        # Without a negative cycle no vertex can be relaxed as many times as
+        # there are vertices
+        relax_count = {}
+        limit = len(dist)
+        while queue:
+            c1 = queue.popleft()
+            queued.discard(c1)
+            for c2 in graph[c1]:
+                weight = edges[(c1, c2)]
+                if dist[c2] - (dist[c1] + weight) >= tolerance:
+                    dist[c2] = dist[c1] + weight
+                    prev[c2] = c1
+                    relax_count[c2] = relax_count.get(c2, 0) + 1
+                    if relax_count[c2] >= limit:
+                        # There is a negative cycle, which is reported by a
+                        # full run so it is the one a full run finds
+                        return self.find_negative_cycle(tolerance)
+                    if c2 not in queued:
+                        queue.append(c2)
+                        queued.add(c2)
+
+        return dist, prev, None, []
+
+    def find_arbitrage_cycles(self, top=5, max_length=4, tolerance=0.0001,
+                              max_steps=100000):
+        """
+        Finds the distinct negative cycles of up to max_length edges, ranked
+        by their gross return.
+
+        Bellman-Ford from the virtual source is run first, and if it settles
+        there is no cycle to find. Otherwise its distances are used to reweight
+        the edges (w + dist[u] - dist[v]), which leaves the weight of every
+        cycle unchanged but makes almost every edge non-negative. The cycles
+        are then enumerated depth first from each vertex in turn, only
+        through vertices after it so each cycle is found once, abandoning a
+        path once even the most negative edges could not bring it back under
+        -tolerance. At most max_steps path extensions are made in total.
+
+        >>> g = BellmanFord()
+        >>> now = clock.SYSTEM.now()
+        >>> for c1, c2, rate in [('GBP', 'USD', 1.25), ('USD', 'JPY', 100.0), \
+                                 ('GBP', 'JPY', 130.0), ('EUR', 'USD', 1.1), \
+                                 ('EUR', 'JPY', 112.0)]:
+        ...     g.add_to_graph([now, c1, c2, rate])
+        >>> for gross, cycle in g.find_arbitrage_cycles():
+        ...     print(round(gross, 4), cycle)
+        1.04 ['GBP', 'JPY', 'USD', 'GBP']
+        1.0214 ['GBP', 'JPY', 'EUR', 'USD', 'GBP']
+        1.0182 ['USD', 'EUR', 'JPY', 'USD']
+
+        :param top: Number of cycles to return
+        :param max_length: Most edges in a cycle
+        :param tolerance: Cycles must weigh less than -tolerance
+        :param max_steps: Limit on the work done enumerating
+        :return: List of up to top (gross return, cycle) tuples, the most
+                 profitable first, each cycle listing the vertices in order
+                 and ending with the first one
+        """
+        edges = self.edges
+        dist = dict.fromkeys(self.graph.keys(), 0)
+        for _ in range(len(dist)):
+            relaxed = False
+            for (c1, c2), weight in edges.items():
+                if dist[c2] - (dist[c1] + weight) >= tolerance:
+                    dist[c2] = dist[c1] + weight
+                    relaxed = True
+            if not relaxed:
+                return []
+
+        # Outgoing edges by reweighted weight, cheapest first
+        reduced = {vertex: [] for vertex in dist}
+        for (c1, c2), weight in edges.items():
+            reduced[c1].append((weight + dist[c1] - dist[c2], c2))
+        lowest = 0
+        for out in reduced.values():
+            out.sort()
+            if out and out[0][0] < lowest:
+                lowest = out[0][0]
+
+        order = {vertex: i for i, vertex in enumerate(dist)}
+        found = []
+        steps = 0
+        for start in dist:
+            stack = [(start, [start], 0)]
+            while stack and steps < max_steps:
+                vertex, path, weight = stack.pop()
+                remaining = max_length - len(path)
+                for edge_weight, nxt in reduced[vertex]:
+                    total = weight + edge_weight
+                    # Even the most negative edges for the rest of the
+                    # cycle would not make it negative, and the edges are
+                    # sorted so no later one will either
+                    if total + remaining * lowest >= -tolerance:
+                        break
+                    steps += 1
+                    if nxt == start:
+                        if total < -tolerance:
+                            found.append(path + [start])
+                    elif (remaining > 0 and order[nxt] > order[start]
+                          and nxt not in path):
+                        stack.append((nxt, path + [nxt], total))
+
+        ranked = sorted(((self.cycle_return(cycle), cycle) for cycle in found),
+                        reverse=True)
+        return ranked[:top]
+
+    def find_short_cycles(self, crosses, tolerance=0.0001):
+        """
+        Finds the most profitable triangle or quadrilateral through each
+        direction of the given crosses, for a quick first check of the quotes
+        just added. A cycle is closed from the far end of the edge back to
+        its near end through one or two neighbours, so a cross costs O(deg^2)
+        rather than a run of Bellman-Ford, and only the best cycle through
+        each edge is kept rather than every one a mispriced cross makes.
+
+        >>> g = BellmanFord()
+        >>> now = clock.SYSTEM.now()
+        >>> for c1, c2, rate in [('GBP', 'USD', 1.25), ('USD', 'JPY', 100.0), \
+                                 ('GBP', 'JPY', 130.0), ('EUR', 'USD', 1.1), \
+                                 ('EUR', 'JPY', 112.0)]:
+        ...     g.add_to_graph([now, c1, c2, rate])
+        >>> for gross, cycle in g.find_short_cycles([('GBP', 'JPY'), \
+                                                     ('EUR', 'JPY')]):
+        ...     print(round(gross, 4), cycle)
+        1.04 ['GBP', 'JPY', 'USD', 'GBP']
+        1.0214 ['EUR', 'USD', 'GBP', 'JPY', 'EUR']
+        1.0182 ['EUR', 'JPY', 'USD', 'EUR']
+
+        :param crosses: Iterable of (currency 1, currency 2) quoted crosses
+        :param tolerance: Cycles must weigh less than -tolerance
+        :return: List of (gross return, cycle) tuples, at most one for each
+                 direction of each cross, the most profitable first, each
+                 cycle listing the vertices in order and ending with the
+                 first one
+        """
+        graph = self.graph
+        edges = self.edges
+        found = {}
+        for c1, c2 in crosses:
+            for u, v in ((c1, c2), (c2, c1)):
+                if (u, v) not in edges:
+                    continue
+                first = edges[(u, v)]
+                back = graph[u]
+                best, best_path = -tolerance, None
+                for x in graph[v]:
+                    if x == u:
+                        continue
+                    second = first + edges[(v, x)]
+                    if u in graph[x]:
+                        weight = second + edges[(x, u)]
+                        if weight < best:
+                            best, best_path = weight, (x,)
+                    for y in graph[x]:
+                        if y != v and y != u and y in back:
+                            weight = second + edges[(x, y)] + edges[(y, u)]
+                            if weight < best:
+                                best, best_path = weight, (x, y)
+                if best_path is not None:
+                    self._add_short_cycle(found, [u, v, *best_path])
+        ranked = sorted(((self.cycle_return(cycle), cycle)
+                         for cycle in found.values()), reverse=True)
+        return ranked
+
+    @staticmethod
+    def _add_short_cycle(found, path):
+        """
+        Adds a cycle to the ones found, once whichever vertex it was found
+        from, starting it at its smallest vertex
+        :param found: Dictionary of cycle by its vertices from the smallest
+        :param path: Vertices of the cycle in order, without the repeated end
+        :return: None
+        """
+        i = path.index(min(path))
+        key = tuple(path[i:] + path[:i])
+        if key not in found:
+            found[key] = list(key) + [key[0]]
+
+    @classmethod
+    def _walk_to_cycle(cls, prev, vertex, n):
+        """
+        Finds the cycle behind a vertex that can still be relaxed. Walking
+        back as many steps as there are vertices lands on the cycle if there
+        is one, which is then traced.
+        :param prev: predecessor dictionary from a run of Bellman-Ford
+        :param vertex: vertex whose incoming edge could still be relaxed
+        :param n: Number of vertices
+        :return: The vertices of the cycle in reverse order, as in
+                 _trace_cycle, or an empty list if there is none
+        """
+        for _ in range(n):
+            if prev[vertex] is None:
+                break
+            vertex = prev[vertex]
+        return cls._trace_cycle(prev, vertex)
+
+    @staticmethod
+    def _trace_cycle(prev, ending_vertex):
+        """
+        Follows the predecessors back from ending_vertex to check whether the
+        vertex sits on a cycle
+        :param prev: predecessor dictionary from a run of Bellman-Ford
+        :param ending_vertex: vertex whose incoming edge could still be relaxed
+        :return: The vertices of the cycle in reverse order, starting and
+                 ending with ending_vertex, or an empty list if there is none
+        """
+        potential_cycle = [ending_vertex]
+        visited = {ending_vertex}
+        curr_vertex = prev[ending_vertex]
+
+        # This loop checks if the negative edge is a part of
+        # a cycle according to the prev
+        while curr_vertex is not None:
+            potential_cycle.append(curr_vertex)
+            if ending_vertex == curr_vertex:
+                return potential_cycle
+            elif curr_vertex in visited:
+                break
+            visited.add(curr_vertex)
+            curr_vertex = prev[curr_vertex]
+        return []
@@ -0,0 +1,1096 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+
+Benchmarks for the arbitrage detection pipeline, run on synthetic quotes so
+that no publisher is needed. Run with the name of a benchmark, for example:
+
+    python benchmark.py log_weights
+"""
+import contextlib
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+from itertools import product
+from math import log
+from string import ascii_uppercase
+
+import bellman_ford
+import clock
+import compact_bellman_ford
+import dense_bellman_ford
+import event_sink
+import fxp_bytes
+import forex_provider
+import fxp_bytes_subscriber
+import lab3
+import metrics
+import parallel_search
+import quote_table
+
+
+def currency_codes(count):
+    """
+    Makes up count distinct 3-letter currency codes
+    :param count: How many codes are needed
+    :return: List of currency codes
+    """
+    codes = []
+    for letters in product(ascii_uppercase, repeat=3):
+        if len(codes) == count:
+            break
+        codes.append(''.join(letters))
+    return codes
+
+
+def dense_quotes(count, seed=0):
+    """
+    Quotes every cross between count currencies, priced off a random
+    reference rate per currency so that there is no arbitrage
+    :param count: Number of currencies
+    :param seed: Seed for the random reference rates
+    :return: List of quotes in the list format used by add_to_graph
+    """
+    rng = random.Random(seed)
+    codes = currency_codes(count)
+    reference = {code: rng.uniform(0.5, 150.0) for code in codes}
+    timestamp = clock.SYSTEM.now()
+    quotes = []
+    for i, c1 in enumerate(codes):
+        for c2 in codes[i + 1:]:
+            quotes.append([timestamp, c1, c2, reference[c2] / reference[c1]])
+    return quotes
+
+
+def build_graph(quotes, graph_class=bellman_ford.BellmanFord):
+    """
+    Builds a graph out of the given quotes
+    :param quotes: Quotes in the list format used by add_to_graph
+    :param graph_class: Class of graph to build
+    :return: The graph
+    """
+    g = graph_class()
+    for quote in quotes:
+        g.add_to_graph(quote)
+    return g
+
+
+def random_quote_stream(count, datagrams, quotes_per_datagram=4, seed=0,
+                        arbitrage_rate=0.05, stale_rate=0.05,
+                        volatility=0.0001):
+    """
+    Generates datagrams of quotes from a random walk of reference rates, in
+    the spirit of forex_provider.TestPublisher. Some quotes are mispriced to
+    put in an arbitrage and some are dated in the past so that they are
+    removed as stale by the next sweep.
+    :param count: Number of currencies
+    :param datagrams: Number of datagrams to generate
+    :param quotes_per_datagram: Quotes in each datagram
+    :param seed: Seed for the random walk
+    :param arbitrage_rate: Chance of a quote being mispriced by about 1%
+    :param stale_rate: Chance of a quote already being stale
+    :param volatility: Standard deviation of each step of the random walk
+    :return: Generator of lists of quotes in the list format of add_to_graph
+    """
+    rng = random.Random(seed)
+    codes = currency_codes(count)
+    reference = {code: rng.uniform(0.5, 150.0) for code in codes}
+    for _ in range(datagrams):
+        quotes = []
+        for _ in range(quotes_per_datagram):
+            c1, c2 = rng.sample(codes, 2)
+            reference[c1] *= rng.gauss(1.0, volatility)
+            rate = reference[c2] / reference[c1]
+            if rng.random() < arbitrage_rate:
+                rate *= rng.choice((0.99, 1.01))
+            timestamp = clock.SYSTEM.now()
+            if rng.random() < stale_rate:
+                timestamp -= 5 * clock.MICROS_PER_SECOND
+            quotes.append([timestamp, c1, c2, rate])
+        yield quotes
+
+
+def feed_stream(graphs, count, datagrams, seed=0, **options):
+    """
+    Adds the same random quote stream to several graphs, each datagram after
+    a stale sweep as the subscriber does, so that their results can be
+    compared after every datagram, as the doctests in bellman_ford.py do
+    :param graphs: Graphs to keep in step
+    :param count: Number of currencies
+    :param datagrams: Number of datagrams in the stream
+    :param seed: Seed for the stream
+    :param options: Keyword arguments for random_quote_stream
+    :return: Generator of the quotes of each datagram, once every graph has
+             them
+    """
+    for quotes in random_quote_stream(count, datagrams, seed=seed,
+                                      **options):
+        for g in graphs:
+            g.remove_stale_quotes()
+            for quote in quotes:
+                g.add_to_graph(quote)
+        yield quotes
+
+
+def cycle_weight(g, cycle):
+    """
+    Adds up the edge weights of a cycle in the reverse order returned by the
+    Bellman-Ford functions
+    :param g: BellmanFord graph
+    :param cycle: Vertices of the cycle in reverse order
+    :return: Sum of the -log rates along the cycle
+    """
+    return sum(g.edges[(cycle[i + 1], cycle[i])]
+               for i in range(len(cycle) - 1))
+
+
+def check_expiry(count=6, quotes=5000, seed=0):
+    """
+    Feeds the same quotes, some of them late and some quoting a cross the
+    other way round, to the dictionary and compact engines on a manual clock
+    and counts the times their edges differ after a stale sweep
+
+    >>> check_expiry()
+    0
+
+    :param count: Number of currencies
+    :param quotes: Number of quotes
+    :param seed: Seed for the quotes
+    :return: Number of sweeps after which the edges differ
+    """
+    rng = random.Random(seed)
+    codes = currency_codes(count)
+    manual = clock.ManualClock()
+    graphs = (bellman_ford.BellmanFord(clock_source=manual),
+              compact_bellman_ford.CompactBellmanFord(clock_source=manual))
+    mismatches = 0
+    for _ in range(quotes):
+        manual.advance(rng.randint(0, 300000))
+        micros = manual.now() - rng.choice((0, 0, 0, clock.MICROS_PER_SECOND))
+        c1, c2 = rng.sample(codes, 2)
+        rate = rng.uniform(0.5, 2.0)
+        for g in graphs:
+            g.add_to_graph([micros, c1, c2, rate])
+        removed = [g.remove_stale_quotes() for g in graphs]
+        if (removed[0] != removed[1]
+                or dict(graphs[0].edges) != dict(graphs[1].edges)):
+            mismatches += 1
+    return mismatches
+
+
+def write_table(name, count, writes):
+    """
+    Writes to a quote table as fast as possible, every cross getting the
+    same timestamp and price in each write. Run in its own process by
+    check_table.
+    :param name: Name of the quote table's shared memory
+    :param count: Number of currencies
+    :param writes: Number of writes
+    :return: None
+    """
+    table = quote_table.QuoteTable(name)
+    table.owner = False  # the checking process frees it
+    codes = currency_codes(count)
+    crosses = [(c1, c2) for i, c1 in enumerate(codes) for c2 in codes[i + 1:]]
+    for i in range(1, writes + 1):
+        table.write([(i, c1, c2, float(i)) for c1, c2 in crosses])
+    table.close()
+
+
+def check_table(count=12, writes=20000):
+    """
+    Reads a quote table while another process writes to it and counts the
+    reads that mix two writes, which the sequence number must prevent
+
+    >>> check_table()
+    0
+
+    :param count: Number of currencies
+    :param writes: Number of writes
+    :return: Number of inconsistent reads
+    """
+    table = quote_table.QuoteTable(capacity=count * count)
+    writer = multiprocessing.Process(target=write_table,
+                                     args=(table.name, count, writes))
+    writer.start()
+    torn = 0
+    latest = 0
+    while latest < writes:
+        sequence, data = table.read()
+        values = {(micros, price) for _, _, micros, price
+                  in quote_table.SLOT.iter_unpack(data)}
+        if len(values) > 1:
+            torn += 1
+        elif values:
+            latest = values.pop()[0]
+    writer.join()
+    table.close()
+    return torn
+
+
+def legacy_shortest_paths(graph, start_vertex, tolerance=0.0001):
+    """
+    The relaxation loop of shortest_paths as it was before the edge weights
+    were precomputed, taking the logarithm of the rate on every relaxation.
+    Kept only as the baseline for the log_weights benchmark.
+    :param graph: Dictionary of signed rates as stored in BellmanFord.graph
+    :param start_vertex: start of all paths
+    :param tolerance: only if a path is more than tolerance better will
+                      it be relaxed
+    :return: distance dictionary
+    """
+    dist = {vertex: float("Inf") for vertex in graph}
+    dist[start_vertex] = 0
+    for _ in range(len(graph) - 1):
+        for c1, edges in graph.items():
+            for c2, weight in edges.items():
+                if weight > 0:
+                    weight = -log(weight, 10)
+                else:
+                    weight = log(abs(weight), 10)
+                if dist[c1] != float("Inf") and dist[c1] + weight < dist[c2]:
+                    if dist[c2] - (dist[c1] + weight) >= tolerance:
+                        dist[c2] = dist[c1] + weight
+    return dist
+
+
+def bench_log_weights(sizes=(10, 20, 30, 40), repeat=5):
+    """
+    Compares one Bellman-Ford run with the logarithm taken inside the
+    relaxation loop against the precomputed edge weights
+    :param sizes: Currency counts of the dense graphs to run on
+    :param repeat: Runs per measurement, the best one is reported
+    :return: None
+    """
+    print('{:>6} {:>7} {:>12} {:>12} {:>8}'.format(
+        'ccys', 'edges', 'before ms', 'after ms', 'speedup'))
+    for size in sizes:
+        g = build_graph(dense_quotes(size))
+        start = next(iter(g.get_vertices()))
+        before = min(timeit.repeat(
+            lambda: legacy_shortest_paths(g.graph, start),
+            number=1, repeat=repeat))
+        after = min(timeit.repeat(
+            lambda: g.shortest_paths(start), number=1, repeat=repeat))
+        print('{:>6} {:>7} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(
+            size, len(g.edges), before * 1000, after * 1000, before / after))
+
+
+def per_vertex_detection(g):
+    """
+    Looks for a negative cycle by running shortest_paths from every vertex in
+    turn, the way Lab3 did before find_negative_cycle
+    :param g: BellmanFord graph
+    :return: The first cycle found, or an empty list
+    """
+    for vertex in g.get_vertices():
+        cycle = g.shortest_paths(vertex)[3]
+        if cycle:
+            return cycle
+    return []
+
+
+def bench_detection(sizes=(10, 20, 30), repeat=3):
+    """
+    Compares detection on a graph without arbitrage (the common case) by
+    running shortest_paths from every vertex against one run of
+    find_negative_cycle
+    :param sizes: Currency counts of the dense graphs to run on
+    :param repeat: Runs per measurement, the best one is reported
+    :return: None
+    """
+    print('{:>6} {:>7} {:>14} {:>14} {:>8}'.format(
+        'ccys', 'edges', 'per vertex ms', 'one pass ms', 'speedup'))
+    for size in sizes:
+        g = build_graph(dense_quotes(size))
+        before = min(timeit.repeat(lambda: per_vertex_detection(g),
+                                   number=1, repeat=repeat))
+        after = min(timeit.repeat(lambda: g.find_negative_cycle(),
+                                  number=1, repeat=repeat))
+        print('{:>6} {:>7} {:>14.3f} {:>14.3f} {:>7.1f}x'.format(
+            size, len(g.edges), before * 1000, after * 1000, before / after))
+
+
+def bench_incremental(sizes=(10, 30, 60), datagrams=300):
+    """
+    Compares the average detection time per datagram of full and incremental
+    runs over a stream of quotes updating a few crosses at a time
+    :param sizes: Currency counts to run on
+    :param datagrams: Datagrams in the stream after the graph is filled in
+    :return: None
+    """
+    print('{:>6} {:>7} {:>12} {:>12} {:>8}'.format(
+        'ccys', 'edges', 'full ms', 'repair ms', 'speedup'))
+    for size in sizes:
+        stream = list(random_quote_stream(size, datagrams, seed=size,
+                                          arbitrage_rate=0, stale_rate=0,
+                                          volatility=0.000001))
+        timings = []
+        for incremental in (False, True):
+            g = build_graph(dense_quotes(size, seed=size))
+            g.find_negative_cycle()
+            elapsed = 0
+            for quotes in stream:
+                for quote in quotes:
+                    g.add_to_graph(quote)
+                start = timeit.default_timer()
+                g.find_negative_cycle(incremental=incremental)
+                elapsed += timeit.default_timer() - start
+            timings.append(elapsed / datagrams)
+        print('{:>6} {:>7} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(
+            size, len(g.edges), timings[0] * 1000, timings[1] * 1000,
+            timings[0] / timings[1]))
+
+
+def bench_dense(sizes=(5, 10, 20, 40, 80, 160), repeat=3):
+    """
+    Finds the graph size where the NumPy engine overtakes the dictionary one.
+    Each graph has one mispriced cross, so detection runs every round rather
+    than stopping early.
+    :param sizes: Currency counts of the dense graphs to run on
+    :param repeat: Runs per measurement, the best one is reported
+    :return: None
+    """
+    print('{:>6} {:>7} {:>12} {:>12} {:>8}'.format(
+        'ccys', 'edges', 'dict ms', 'dense ms', 'speedup'))
+    for size in sizes:
+        quotes = dense_quotes(size)
+        quotes[-1][3] *= 1.01
+        timings = []
+        for graph_class in (bellman_ford.BellmanFord,
+                            dense_bellman_ford.DenseBellmanFord):
+            g = build_graph(quotes, graph_class)
+            timings.append(min(timeit.repeat(lambda: g.find_negative_cycle(),
+                                             number=1, repeat=repeat)))
+        print('{:>6} {:>7} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(
+            size, len(g.edges), timings[0] * 1000, timings[1] * 1000,
+            timings[0] / timings[1]))
+
+
+def legacy_stale_scan(last_quoted):
+    """
+    The stale quote sweep as it was before the expiry heap, reading the clock
+    for and looking at every quote. Kept only as the baseline for the stale
+    benchmark.
+    :param last_quoted: Dictionary of quote timestamps keyed by cross
+    :return: List of the stale crosses
+    """
+    return [key for key, value in last_quoted.items()
+            if clock.SYSTEM.now() - value > 1_500_000]
+
+
+def bench_stale(sizes=(10, 40, 80), repeat=5):
+    """
+    Compares a sweep for stale quotes when none have expired, the common
+    case, scanning every quote against popping the expiry heap
+    :param sizes: Currency counts of the dense graphs to run on
+    :param repeat: Runs per measurement, the best one is reported
+    :return: None
+    """
+    print('{:>6} {:>7} {:>12} {:>12} {:>8}'.format(
+        'ccys', 'quotes', 'scan us', 'heap us', 'speedup'))
+    for size in sizes:
+        g = build_graph(dense_quotes(size))
+        before = min(timeit.repeat(lambda: legacy_stale_scan(g.last_quoted),
+                                   number=10, repeat=repeat)) / 10
+        after = min(timeit.repeat(lambda: g.remove_stale_quotes(),
+                                  number=10, repeat=repeat)) / 10
+        print('{:>6} {:>7} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(
+            size, len(g.last_quoted), before * 1e6, after * 1e6,
+            before / after))
+
+
+def per_quote_decode(data):
+    """
+    Decodes a datagram one 32 byte slice at a time, the way Lab3 did before
+    unmarshal_messages
+    :param data: Datagram from the publisher
+    :return: List of quotes in list format
+    """
+    return [fxp_bytes_subscriber.unmarshal_message(data[i * 32:(i + 1) * 32])
+            for i in range(len(data) // 32)]
+
+
+def bench_decode(repeat=5, number=2000):
+    """
+    Compares quotes decoded per second from full datagrams of
+    MAX_QUOTES_PER_MESSAGE quotes, one quote at a time against the batch
+    decoder
+    :param repeat: Runs per measurement, the best one is reported
+    :param number: Datagrams decoded per run
+    :return: None
+    """
+    quotes = [{'cross': '{}/{}'.format(c1, c2), 'price': price}
+              for _, c1, c2, price in dense_quotes(11)]
+    data = fxp_bytes.marshal_message(quotes[:fxp_bytes.MAX_QUOTES_PER_MESSAGE])
+    count = len(data) // fxp_bytes_subscriber.QUOTE_SIZE
+    print('{:>12} {:>14} {:>8}'.format('decoder', 'quotes/sec', 'speedup'))
+    rates = []
+    for name, decode in (('per quote', per_quote_decode),
+                         ('batch', fxp_bytes_subscriber.unmarshal_messages)):
+        best = min(timeit.repeat(lambda: decode(data),
+                                 number=number, repeat=repeat))
+        rates.append(count * number / best)
+        print('{:>12} {:>14,.0f} {:>7.1f}x'.format(
+            name, rates[-1], rates[-1] / rates[0]))
+
+
+def legacy_marshal_message(quote_sequence):
+    """
+    marshal_message as it was before pack_quotes, concatenating bytes for
+    every field. Kept only as the baseline for the encode benchmark.
+    :param quote_sequence: list of quote structures ('cross' and 'price', may
+                           also have 'timestamp')
+    :return: byte stream to send in UDP message
+    """
+    message = bytes()
+    default_time = fxp_bytes.serialize_utcdatetime(datetime.utcnow())
+    padding = b'\x00' * 10
+    for quote in quote_sequence:
+        if 'timestamp' in quote:
+            message += fxp_bytes.serialize_utcdatetime(quote['timestamp'])
+        else:
+            message += default_time
+        message += quote['cross'][0:3].encode('utf-8')
+        message += quote['cross'][4:7].encode('utf-8')
+        message += fxp_bytes.serialize_price(quote['price'])
+        message += padding
+    return message
+
+
+def bench_encode(repeat=5, number=2000):
+    """
+    Compares messages encoded per second at MAX_QUOTES_PER_MESSAGE quotes
+    with the old concatenating encoder, marshal_message and a reused
+    MessageEncoder
+    :param repeat: Runs per measurement, the best one is reported
+    :param number: Messages encoded per run
+    :return: None
+    """
+    timestamp = clock.SYSTEM.now()
+    quotes = [{'timestamp': timestamp, 'cross': '{}/{}'.format(c1, c2),
+               'price': price} for _, c1, c2, price in dense_quotes(11)]
+    quotes = quotes[:fxp_bytes.MAX_QUOTES_PER_MESSAGE]
+    encoder = fxp_bytes.MessageEncoder()
+    assert legacy_marshal_message(quotes) == fxp_bytes.marshal_message(quotes)
+    print('{:>16} {:>14} {:>8}'.format('encoder', 'messages/sec', 'speedup'))
+    rates = []
+    for name, encode in (('concatenating', legacy_marshal_message),
+                         ('marshal_message', fxp_bytes.marshal_message),
+                         ('MessageEncoder', encoder.encode)):
+        best = min(timeit.repeat(lambda: encode(quotes),
+                                 number=number, repeat=repeat))
+        rates.append(number / best)
+        print('{:>16} {:>14,.0f} {:>7.1f}x'.format(
+            name, rates[-1], rates[-1] / rates[0]))
+
+
+def bench_parallel(size=60, max_workers=4, repeat=3):
+    """
+    Times the search from every vertex on 1 to max_workers worker processes,
+    against running it serially in this process. The pools are started
+    before timing, as they are reused for every search.
+    :param size: Currency count of the dense graph, which has one mispriced
+                 cross
+    :param max_workers: Largest number of worker processes to try
+    :param repeat: Runs per measurement, the best one is reported
+    :return: None
+    """
+    quotes = dense_quotes(size)
+    quotes[-1][3] *= 1.01
+    g = build_graph(quotes)
+    graph_snapshot = parallel_search.snapshot(g)
+    vertices = list(g.get_vertices())
+    serial = min(timeit.repeat(
+        lambda: parallel_search.search_shard(graph_snapshot, vertices),
+        number=1, repeat=repeat))
+    print('{:>8} {:>10} {:>8}'.format('workers', 'ms', 'speedup'))
+    print('{:>8} {:>10.1f} {:>7.1f}x'.format('serial', serial * 1000, 1.0))
+    for workers in range(1, max_workers + 1):
+        search = parallel_search.ParallelSearch(workers)
+        search.find_cycles(g)  # starts the worker processes
+        best = min(timeit.repeat(lambda: search.find_cycles(g),
+                                 number=1, repeat=repeat))
+        search.shutdown()
+        print('{:>8} {:>10.1f} {:>7.1f}x'.format(
+            workers, best * 1000, serial / best))
+
+
+def bench_enumerate(sizes=(10, 20, 40), mispriced=3, repeat=3):
+    """
+    Times finding the top 5 arbitrage cycles of up to 4 conversions on dense
+    graphs with a few mispriced crosses
+    :param sizes: Currency counts of the dense graphs to run on
+    :param mispriced: Number of crosses mispriced by about 1%
+    :param repeat: Runs per measurement, the best one is reported
+    :return: None
+    """
+    print('{:>6} {:>7} {:>8} {:>12} {:>10}'.format(
+        'ccys', 'edges', 'cycles', 'best return', 'ms'))
+    for size in sizes:
+        quotes = dense_quotes(size)
+        rng = random.Random(size)
+        for quote in rng.sample(quotes, mispriced):
+            quote[3] *= rng.choice((0.99, 1.01))
+        g = build_graph(quotes)
+        cycles = g.find_arbitrage_cycles()
+        best = min(timeit.repeat(lambda: g.find_arbitrage_cycles(),
+                                 number=1, repeat=repeat))
+        print('{:>6} {:>7} {:>8} {:>12.4f} {:>10.3f}'.format(
+            size, len(g.edges), len(cycles), cycles[0][0], best * 1000))
+
+
+def bench_memory(sizes=(10, 40, 120), repeat=3):
+    """
+    Measures the memory allocated per directed edge to build a dense graph
+    and run detection on it once, and the time of a full detection run, for
+    the dictionary and compact engines
+    :param sizes: Currency counts of the dense graphs to build
+    :param repeat: Runs per measurement, the best one is reported
+    :return: None
+    """
+    print('{:>6} {:>7} {:>9} {:>12} {:>12}'.format(
+        'ccys', 'edges', 'engine', 'bytes/edge', 'detect ms'))
+    for size in sizes:
+        quotes = dense_quotes(size)
+        for name, graph_class in (
+                ('dict', bellman_ford.BellmanFord),
+                ('compact', compact_bellman_ford.CompactBellmanFord)):
+            tracemalloc.start()
+            g = build_graph(quotes, graph_class)
+            g.find_negative_cycle()  # settles the incremental bookkeeping
+            allocated = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            best = min(timeit.repeat(lambda: g.find_negative_cycle(),
+                                     number=1, repeat=repeat))
+            print('{:>6} {:>7} {:>9} {:>12.1f} {:>12.3f}'.format(
+                size, len(g.edges), name, allocated / len(g.edges),
+                best * 1000))
+
+
+def legacy_publish(publisher, quotes):
+    """
+    TestPublisher.publish before the fan-out rework, without the random walk:
+    rescans every subscription for expiry, then prints and sends the message
+    to each subscriber in turn on a blocking socket
+    :param publisher: TestPublisher with its subscriptions registered
+    :param quotes: Quotes to publish
+    :return: None
+    """
+    ts = clock.SYSTEM.now()
+    for subscriber in set(publisher.subscriptions):
+        if ts - publisher.subscriptions[subscriber] >= \
+                forex_provider.SUBSCRIPTION_TIME * clock.MICROS_PER_SECOND:
+            del publisher.subscriptions[subscriber]
+    message = fxp_bytes.marshal_message(quotes)
+    for subscriber in publisher.subscriptions:
+        print('publishing {} to {}'.format(quotes, subscriber))
+        publisher.socket.sendto(message, subscriber)
+
+
+def bench_fanout(counts=(1, 10, 100, 1000, 4000), publishes=20):
+    """
+    Measures the messages per second sent by the publisher to growing numbers
+    of subscribers, against the old publish loop printing to /dev/null. The
+    subscribers are unused local ports, so the datagrams are dropped by the
+    kernel without anything having to read them.
+    :param counts: Subscriber counts to try
+    :param publishes: Messages published to every subscriber per measurement
+    :return: None
+    """
+    quotes = [{'cross': 'GBP/USD', 'price': 1.25},
+              {'cross': 'USD/JPY', 'price': 100.0},
+              {'cross': 'EUR/USD', 'price': 1.10}]
+    print('{:>11} {:>12} {:>12} {:>8}'.format(
+        'subscribers', 'legacy/s', 'fan-out/s', 'speedup'))
+    for count in counts:
+        publisher = forex_provider.TestPublisher(verbose=False)
+        for port in range(40000, 40000 + count):
+            publisher.register_subscription(('127.0.0.1', port))
+
+        publisher.socket.setblocking(True)
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            legacy = timeit.timeit(lambda: legacy_publish(publisher, quotes),
+                                   number=publishes)
+        publisher.socket.setblocking(False)
+
+        def fan_out():
+            publisher.expire_subscriptions(clock.SYSTEM.now())
+            publisher.fan_out(publisher.encoder.encode(quotes))
+        fast = timeit.timeit(fan_out, number=publishes)
+        publisher.socket.close()
+        messages = count * publishes
+        print('{:>11} {:>12,.0f} {:>12,.0f} {:>7.1f}x'.format(
+            count, messages / legacy, messages / fast, legacy / fast))
+
+
+def bench_short(sizes=(10, 20, 40), repeat=5, number=20):
+    """
+    Times checking the triangles and quadrilaterals through one requoted
+    cross, against a full detection run, on dense graphs where the cross is
+    priced in line with the others and where it is mispriced by 1%. Without
+    arbitrage the full run stops after its first pass, so the short check
+    only pays off once there is something to find.
+    :param sizes: Currency counts of the dense graphs to run on
+    :param repeat: Runs per measurement, the best one is reported
+    :param number: Checks per run
+    :return: None
+    """
+    print('{:>6} {:>7} {:>10} {:>12} {:>12} {:>8}'.format(
+        'ccys', 'edges', 'cross', 'full ms', 'short ms', 'speedup'))
+    for size in sizes:
+        for label, factor in (('in line', 1.0), ('mispriced', 1.01)):
+            quotes = dense_quotes(size)
+            quotes[0][3] *= factor
+            g = build_graph(quotes)
+            cross = [(quotes[0][1], quotes[0][2])]
+            full = min(timeit.repeat(lambda: g.find_negative_cycle(),
+                                     number=number, repeat=repeat)) / number
+            short = min(timeit.repeat(lambda: g.find_short_cycles(cross),
+                                      number=number, repeat=repeat)) / number
+            print('{:>6} {:>7} {:>10} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(
+                size, len(g.edges), label, full * 1000, short * 1000,
+                full / short))
+
+
+def bench_gating(sizes=(10, 30), datagrams=1000):
+    """
+    Runs a stream of small price moves with rare mispriced and stale quotes
+    through detection on every datagram, and again only when search_needed
+    says so, counting the searches run and skipped. Incremental detection
+    already costs little when nothing moved far, so the gate mostly saves
+    the engines that always run in full.
+    :param sizes: Currency counts to try
+    :param datagrams: Datagrams in each stream
+    :return: None
+    """
+    engines = (
+        ('dict', bellman_ford.BellmanFord,
+         lambda g: g.find_negative_cycle(incremental=True)[3]),
+        ('dense', dense_bellman_ford.DenseBellmanFord,
+         lambda g: g.find_negative_cycle()[3]))
+    print('{:>6} {:>7} {:>8} {:>8} {:>11} {:>10} {:>8}'.format(
+        'ccys', 'engine', 'run', 'skipped', 'always ms', 'gated ms',
+        'speedup'))
+    for size in sizes:
+        stream = list(random_quote_stream(size, datagrams,
+                                          arbitrage_rate=0.0005,
+                                          stale_rate=0.01, volatility=1e-6))
+        for name, graph_class, search in engines:
+            g = graph_class()
+            start = time.perf_counter()
+            for quotes in stream:
+                for quote in quotes:
+                    g.add_to_graph(quote)
+                search(g)
+            always = time.perf_counter() - start
+
+            g = graph_class()
+            found = False
+            run = 0
+            start = time.perf_counter()
+            for quotes in stream:
+                for quote in quotes:
+                    g.add_to_graph(quote)
+                if g.search_needed(g.take_dirty(), found):
+                    found = bool(search(g))
+                    run += 1
+            gated = time.perf_counter() - start
+            print('{:>6} {:>7} {:>8} {:>8} {:>11.1f} {:>10.1f} {:>7.1f}x'
+                  .format(size, name, run, datagrams - run, always * 1000,
+                          gated * 1000, always / gated))
+
+
+def bench_sink(events=100000, repeat=3):
+    """
+    Times reporting quotes as the analysis sees it, printing each one against
+    queueing it for the output thread, writing to /dev/null. A terminal is
+    slower than /dev/null, so this is the least printing costs.
+    :param events: Quote events reported per run
+    :param repeat: Runs per measurement, the best one is reported
+    :return: None
+    """
+    print('{:>10} {:>12} {:>10}'.format('sink', 'ns/event', 'dropped'))
+    with open(os.devnull, 'w') as devnull:
+        for name, make in (
+                ('print', lambda: event_sink.PrintSink(file=devnull)),
+                ('threaded', lambda: event_sink.ThreadedSink(
+                    file=devnull, capacity=events))):
+            best = float('Inf')
+            for _ in range(repeat):
+                sink = make()
+                emit = sink.emit
+                start = time.perf_counter()
+                for i in range(events):
+                    emit('quote', 1136160000000000 + i, 'GBP', 'USD', 1.25)
+                best = min(best, time.perf_counter() - start)
+                sink.close()
+            print('{:>10} {:>12.0f} {:>10}'.format(
+                name, best / events * 1e9, sink.dropped))
+
+
+def legacy_receive(subscriber, seconds):
+    """
+    Lab3's receive loop before batching: one recv(4096) into a new bytes
+    object per loop, each followed by a full analysis
+    :param subscriber: Lab3 subscribed to a single feed
+    :param seconds: How long to receive for
+    :return: Number of datagrams received
+    """
+    listener = subscriber.listener
+    received = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        subscriber.remove_stale_quotes()
+        if not subscriber.selector.select(0.1):
+            continue
+        data = listener.recv(4096)
+        received += 1
+        subscriber.iterate_through_data(data)
+        subscriber.run_bellman()
+    return received
+
+
+def bench_receive(rate=20000, seconds=3.0, rcvbufs=(None, 1 << 22),
+                  port=63200):
+    """
+    Subscribes to a staging provider publishing faster than a datagram can
+    be analysed and counts the datagrams received and the ones the kernel
+    dropped, receiving one datagram per analysis as before and draining the
+    socket in batches, with the default and a larger receive buffer
+    :param rate: Messages per second published
+    :param seconds: How long to receive for
+    :param rcvbufs: Receive buffer sizes to try, None for the default
+    :param port: Port the provider takes subscriptions on
+    :return: None
+    """
+    provider = multiprocessing.Process(target=run_provider, args=(port, rate),
+                                       daemon=True)
+    provider.start()
+    time.sleep(0.5)  # lets the provider bind
+    print('{:>8} {:>10} {:>10} {:>12} {:>8}'.format(
+        'receive', 'rcvbuf', 'received', 'datagrams/s', 'dropped'))
+    try:
+        for rcvbuf in rcvbufs:
+            for name in ('single', 'batched'):
+                subscriber = lab3.Lab3(venues={None: ('127.0.0.1', port)},
+                                       rcvbuf=rcvbuf)
+                with open(os.devnull, 'w') as devnull, \
+                        contextlib.redirect_stdout(devnull):
+                    subscriber.subscribe()
+                    start = time.perf_counter()
+                    if name == 'single':
+                        received = legacy_receive(subscriber, seconds)
+                    else:
+                        received = 0
+                        while time.perf_counter() - start < seconds:
+                            received += subscriber.poll(0.1)
+                    elapsed = time.perf_counter() - start
+                drops = subscriber.receivers[None].drops()
+                subscriber.listener.close()
+                print('{:>8} {:>10} {:>10} {:>12,.0f} {:>8}'.format(
+                    name, subscriber.receivers[None].rcvbuf, received,
+                    received / elapsed, '?' if drops is None else drops))
+    finally:
+        provider.terminate()
+        provider.join()
+
+
+def bench_timestamps(repeat=5, number=2000):
+    """
+    Compares quotes handled per second from decoding a full datagram to
+    adding it to the graph, with every timestamp turned into a datetime as
+    Lab3 did before clock.py, against keeping the integer microseconds
+    :param repeat: Runs per measurement, the best one is reported
+    :param number: Datagrams handled per run
+    :return: None
+    """
+    now = clock.SYSTEM.now()
+    quotes = [{'timestamp': now, 'cross': '{}/{}'.format(c1, c2),
+               'price': price} for _, c1, c2, price in dense_quotes(11)]
+    data = fxp_bytes.marshal_message(quotes[:fxp_bytes.MAX_QUOTES_PER_MESSAGE])
+    count = len(data) // fxp_bytes_subscriber.QUOTE_SIZE
+    micros_to_datetime = clock.micros_to_datetime
+    unmarshal_messages = fxp_bytes_subscriber.unmarshal_messages
+    g = bellman_ford.BellmanFord()
+
+    def as_datetime():
+        for micros, c1, c2, price in unmarshal_messages(data):
+            g.add_to_graph([micros_to_datetime(micros), c1, c2, price])
+
+    def as_micros():
+        for micros, c1, c2, price in unmarshal_messages(data):
+            g.add_to_graph([micros, c1, c2, price])
+
+    print('{:>12} {:>14} {:>8}'.format('timestamps', 'quotes/sec', 'speedup'))
+    rates = []
+    for name, handle in (('datetime', as_datetime), ('micros', as_micros)):
+        g.expiry.clear()
+        best = min(timeit.repeat(handle, number=number, repeat=repeat))
+        rates.append(count * number / best)
+        print('{:>12} {:>14,.0f} {:>7.1f}x'.format(
+            name, rates[-1], rates[-1] / rates[0]))
+
+
+def bench_publish(sizes=(10, 40, 120), repeat=5, number=1000):
+    """
+    Measures what publishing a version adds to the quote written after it,
+    which pays for the copy-on-write of the graph, against writing the quote
+    alone, on dense graphs
+    :param sizes: Currency counts of the dense graphs to run on
+    :param repeat: Runs per measurement, the best one is reported
+    :param number: Quotes written per run
+    :return: None
+    """
+    print('{:>6} {:>7} {:>10} {:>16}'.format(
+        'ccys', 'edges', 'quote us', 'publish+quote us'))
+    for size in sizes:
+        quotes = dense_quotes(size)
+        g = build_graph(quotes)
+        quote = quotes[len(quotes) // 2]
+
+        def add():
+            g.add_to_graph(quote)
+
+        def publish_and_add():
+            g.publish(0)
+            g.add_to_graph(quote)
+
+        timings = []
+        for run in (add, publish_and_add):
+            g.expiry.clear()
+            timings.append(min(timeit.repeat(run, number=number,
+                                             repeat=repeat)) / number)
+        print('{:>6} {:>7} {:>10.2f} {:>16.2f}'.format(
+            size, len(g.edges), timings[0] * 1e6, timings[1] * 1e6))
+
+
+def bench_overlap(rate=20000, seconds=3.0, top=5, port=63500):
+    """
+    Runs a staging provider putting arbitrage in most messages and compares
+    Lab3 searching after every drain with overlap, where a thread searches
+    the latest published version while the main thread keeps receiving. The
+    lag is from a version being published to its search being done.
+    :param rate: Messages per second published
+    :param seconds: How long to receive for
+    :param top: Number of cycles each search ranks, to make searches heavier
+    :param port: Port the provider takes subscriptions on
+    :return: None
+    """
+    provider = multiprocessing.Process(target=run_provider,
+                                       args=(port, rate, 0.9), daemon=True)
+    provider.start()
+    time.sleep(0.5)  # lets the provider bind
+    print('{:>8} {:>11} {:>9} {:>8} {:>8} {:>12}'.format(
+        'mode', 'quotes/sec', 'searches', 'skipped', 'dropped',
+        'lag p99 ms'))
+    devnull = open(os.devnull, 'w')
+    try:
+        for overlap in (False, True):
+            subscriber = lab3.Lab3(venues={None: ('127.0.0.1', port)},
+                                   top=top, overlap=overlap,
+                                   sink=event_sink.ThreadedSink(file=devnull))
+            subscriber.metrics = metrics.Metrics()
+            subscriber.subscribe()
+            if overlap:
+                threading.Thread(target=subscriber.search_versions,
+                                 daemon=True).start()
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                subscriber.poll(0.1)
+            elapsed = time.perf_counter() - start
+            drops = subscriber.receivers[None].drops()
+            subscriber.listener.close()
+
+            stages = subscriber.metrics.stages
+            counters = subscriber.metrics.counters
+            lag = stages.get('version_lag')
+            print('{:>8} {:>11,.0f} {:>9} {:>8} {:>8} {:>12}'.format(
+                'overlap' if overlap else 'serial',
+                counters.get('quotes', 0) / elapsed,
+                counters.get('searches_run', 0),
+                counters.get('versions_skipped', 0),
+                '?' if drops is None else drops,
+                '-' if lag is None else
+                '{:.2f}'.format(lag.percentile(0.99) / 1e6)))
+            subscriber.sink.close()
+    finally:
+        provider.terminate()
+        provider.join()
+        devnull.close()
+
+
+def bench_shared(rate=20000, seconds=3.0, analyzers=(1, 2), port=63600):
+    """
+    Runs a staging provider putting arbitrage in most messages and compares
+    the latency from a quote being published to an arbitrage being reported
+    with it in the graph, for Lab3 in a single process against Lab3 only
+    receiving into a shared memory quote table searched by analyzer
+    processes. With several analyzers they take turns searching and one
+    reports, so their searches add up.
+    :param rate: Messages per second published
+    :param seconds: How long to receive for
+    :param analyzers: Analyzer process counts to try
+    :param port: Port the provider takes subscriptions on
+    :return: None
+    """
+    provider = multiprocessing.Process(target=run_provider,
+                                       args=(port, rate, 0.9), daemon=True)
+    provider.start()
+    time.sleep(0.5)  # lets the provider bind
+    print('{:>10} {:>11} {:>9} {:>8} {:>8} {:>8} {:>8}'.format(
+        'analyzers', 'quotes/sec', 'searches', 'reports', 'dropped', 'p50 ms',
+        'p99 ms'))
+    devnull = open(os.devnull, 'w')
+    try:
+        for count in (0, *analyzers):
+            table = None
+            results = multiprocessing.Queue()
+            if count:
+                table = quote_table.QuoteTable()
+                with contextlib.redirect_stdout(devnull):
+                    processes = lab3.start_analyzers(
+                        table, count, seconds=seconds + 1.0, results=results)
+            subscriber = lab3.Lab3(venues={None: ('127.0.0.1', port)},
+                                   table=table,
+                                   sink=event_sink.ThreadedSink(file=devnull))
+            subscriber.metrics = metrics.Metrics()
+            subscriber.subscribe()
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                subscriber.poll(0.1)
+            elapsed = time.perf_counter() - start
+            drops = subscriber.receivers[None].drops()
+            subscriber.listener.close()
+            subscriber.sink.close()
+
+            searched = [subscriber.metrics]
+            if count:
+                searched = [results.get() for _ in processes]
+                for process in processes:
+                    process.join()
+                table.close()
+            latency = metrics.Histogram()
+            for analyzer in searched:
+                if 'quote_to_report' in analyzer.stages:
+                    latency.add(analyzer.stages['quote_to_report'])
+            print('{:>10} {:>11,.0f} {:>9} {:>8} {:>8} {:>8.2f} '
+                  '{:>8.2f}'.format(
+                      count or 'single',
+                      subscriber.metrics.counters.get('quotes', 0) / elapsed,
+                      sum(analyzer.counters.get('searches_run', 0)
+                          for analyzer in searched),
+                      sum(analyzer.counters.get('cycles', 0)
+                          for analyzer in searched),
+                      '?' if drops is None else drops,
+                      latency.percentile(0.5) / 1e6,
+                      latency.percentile(0.99) / 1e6))
+    finally:
+        provider.terminate()
+        provider.join()
+        devnull.close()
+
+
+def run_provider(port, rate, arbitrage_rate=0.0):
+    """
+    Runs a staging provider quietly, as the publisher of one venue, without
+    the arbitrage it usually puts in unless asked to
+    :param port: Port to take subscriptions on
+    :param rate: Messages per second to publish
+    :param arbitrage_rate: Chance of putting an arbitrage in each message
+    :return: None
+    """
+    random.seed(port)
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        forex_provider.ForexProvider(
+            ('localhost', port), forex_provider.TestPublisher,
+            arbitrage_rate=arbitrage_rate, verbose=False,
+            rate=rate).run_forever()
+
+
+def bench_venues(counts=(1, 2, 4), rate=2000, seconds=3.0, port=63100):
+    """
+    Runs a staging provider per venue in its own process and measures the
+    quotes per second a multi-venue Lab3 takes in from all of them, along
+    with the number of arbitrage cycles that opened. The providers put in no
+    arbitrage themselves but random walk separately, so any found is across
+    venues. That a spread between venues is found, and closes with the
+    spread, is checked by the doctest of lab3.Lab3.add_quotes.
+    :param counts: Venue counts to try
+    :param rate: Messages per second published by each provider
+    :param seconds: How long to receive for
+    :param port: First of the ports the providers take subscriptions on
+    :return: None
+    """
+    print('{:>7} {:>12} {:>10} {:>10}'.format(
+        'venues', 'quotes/sec', 'searches', 'arbitrage'))
+    for count in counts:
+        ports = range(port, port + count)
+        providers = [multiprocessing.Process(target=run_provider,
+                                             args=(p, rate), daemon=True)
+                     for p in ports]
+        for provider in providers:
+            provider.start()
+        time.sleep(0.5)  # lets the providers bind
+
+        subscriber = lab3.Lab3(venues={'V{}'.format(i): ('127.0.0.1', p)
+                                       for i, p in enumerate(ports)})
+        subscriber.metrics = metrics.Metrics()
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            subscriber.subscribe()
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                subscriber.poll(0.1)
+            elapsed = time.perf_counter() - start
+        for provider in providers:
+            provider.terminate()
+            provider.join()
+
+        stages = subscriber.metrics.stages
+        counters = subscriber.metrics.counters
+        searches = stages['shortest_paths'].total if stages else 0
+        print('{:>7} {:>12,.0f} {:>10} {:>10}'.format(
+            count, counters.get('quotes', 0) / elapsed, searches,
+            counters.get('cycles', 0)))
+
+
+BENCHMARKS = {
+    'log_weights': bench_log_weights,
+    'detection': bench_detection,
+    'incremental': bench_incremental,
+    'dense': bench_dense,
+    'stale': bench_stale,
+    'decode': bench_decode,
+    'encode': bench_encode,
+    'parallel': bench_parallel,
+    'enumerate': bench_enumerate,
+    'memory': bench_memory,
+    'fanout': bench_fanout,
+    'venues': bench_venues,
+    'short': bench_short,
+    'sink': bench_sink,
+    'gating': bench_gating,
+    'receive': bench_receive,
+    'timestamps': bench_timestamps,
+    'publish': bench_publish,
+    'overlap': bench_overlap,
+    'shared': bench_shared,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print('==', name)
+        BENCHMARKS[name]()
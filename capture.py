@@ -0,0 +1,72 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+
+Capture files of the raw datagrams received from the publisher, so a feed can
+be replayed later without running the publisher. A capture is a plain
+sequence of records, each a 10 byte header followed by the datagram:
+
+    8 bytes  receive time, microseconds since the epoch (big-endian)
+    2 bytes  length of the datagram (big-endian)
+"""
+import struct
+
+import clock
+
+RECORD_HEADER = struct.Struct('>QH')
+
+
+class CaptureWriter(object):
+    """
+    Appends datagrams to a capture file
+    """
+    def __init__(self, path, clock_source=None):
+        """
+        Opens the capture file for appending
+        :param path: Path of the capture file
+        :param clock_source: Clock receive times are read from when not
+                             given, the system clock if not given
+        """
+        self.file = open(path, 'ab')
+        self.clock = clock_source or clock.SYSTEM
+
+    def write(self, data, received=None):
+        """
+        Appends a datagram to the capture
+        :param data: Datagram as received
+        :param received: Receive time in microseconds since the epoch, now if
+                         not given
+        :return: None
+        """
+        if received is None:
+            received = self.clock.now()
+        self.file.write(RECORD_HEADER.pack(received, len(data)))
+        self.file.write(data)
+
+    def close(self):
+        """
+        Closes the capture file
+        :return: None
+        """
+        self.file.close()
+
+
+def read_capture(path):
+    """
+    Reads back the datagrams of a capture file, ignoring a record cut short at
+    the end of the file
+    :param path: Path of the capture file
+    :return: Generator of (receive time in microseconds, datagram) tuples
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            received, length = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield received, data
@@ -0,0 +1,102 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+
+Time as the feed carries it: integer microseconds since 00:00:00 UTC on
+1 January 1970. Timestamps stay integers from the wire through the graph,
+stale expiry and sequence checks, and only become datetimes to be shown.
+Whatever needs the current time is given a clock, so a replay or a test can
+substitute a ManualClock and run as fast as it likes.
+"""
+import time
+from datetime import datetime, timedelta
+
+MICROS_PER_SECOND = 1_000_000
+EPOCH = datetime(1970, 1, 1)
+
+
+def utc_micros(utc: datetime) -> int:
+    """
+    Converts a UTC datetime to microseconds since the epoch, exactly
+
+    >>> utc_micros(datetime(1971, 12, 10, 1, 2, 3, 64000))
+    61174923064000
+
+    :param utc: UTC datetime
+    :return: Microseconds since the epoch
+    """
+    delta = utc - EPOCH
+    return (delta.days * 86_400 + delta.seconds) * MICROS_PER_SECOND + \
+        delta.microseconds
+
+
+def micros_to_datetime(micros: int) -> datetime:
+    """
+    Converts microseconds since the epoch to a UTC datetime, for display
+    :param micros: Microseconds since the epoch
+    :return: UTC datetime
+    """
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def seconds_to_micros(seconds: float) -> int:
+    """
+    Converts a duration in seconds to microseconds
+    :param seconds: Duration in seconds
+    :return: Duration in microseconds
+    """
+    return round(seconds * MICROS_PER_SECOND)
+
+
+class SystemClock(object):
+    """
+    The real time
+    """
+    def now(self):
+        """
+        :return: Microseconds since the epoch
+        """
+        return time.time_ns() // 1000
+
+
+class ManualClock(object):
+    """
+    A clock that only moves when told to
+
+    >>> c = ManualClock(1_000_000)
+    >>> c.advance(seconds_to_micros(1.5))
+    >>> c.now()
+    2500000
+    """
+    def __init__(self, start=0):
+        """
+        :param start: Microseconds since the epoch to start at
+        """
+        self.micros = start
+
+    def now(self):
+        """
+        :return: Microseconds since the epoch
+        """
+        return self.micros
+
+    def set(self, micros):
+        """
+        Moves the clock to a time
+        :param micros: Microseconds since the epoch
+        :return: None
+        """
+        self.micros = micros
+
+    def advance(self, micros):
+        """
+        Moves the clock forward
+        :param micros: Microseconds to move by
+        :return: None
+        """
+        self.micros += micros
+
+
+SYSTEM = SystemClock()
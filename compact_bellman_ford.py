@@ -0,0 +1,394 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+"""
+import heapq
+from array import array
+from collections.abc import Mapping
+from math import log
+
+from bellman_ford import BellmanFord
+
+
+class CompactBellmanFord(BellmanFord):
+    """
+    Alternative to BellmanFord that stores the graph in flat arrays instead
+    of dictionaries. Every currency is interned to a small integer index, and
+    each directed edge is one slot across the parallel columns sources,
+    destinations, weights (-log base 10 of the rate), rates (signed, as in
+    BellmanFord.graph) and timestamps (microseconds since the epoch). The
+    adjacency index is a flat capacity x capacity array where
+    adjacency[u * capacity + v] is the slot of the edge from u to v (-1 if
+    there is none), so a cross quoted again is updated in place. Removing an
+    edge moves the last slot into its place, so the columns never have holes.
+    Entries on the expiry heap are single integers packing the timestamp and
+    both indexes.
+
+    The graph and edges attributes are read-only views giving the same
+    dictionary interface as BellmanFord, so everything written against that
+    keeps working. The full Bellman-Ford runs loop over the arrays directly.
+    As the columns are written in place and the views cannot be pointed at
+    a version's rates, this graph can neither publish nor adopt versions.
+    """
+    versioned = False
+
+    def __init__(self, stale_after=1.5, capacity=16, clock_source=None):
+        """
+        Constructs a CompactBellmanFord object
+        :param stale_after: Seconds after which a quote is stale
+        :param capacity: Number of currencies to make room for up front, the
+                         adjacency index grows as needed
+        :param clock_source: Clock stale quotes are judged by, as in
+                             BellmanFord
+        """
+        super().__init__(stale_after, clock_source)
+        self.index = {}  # Index of each currency
+        self.currencies = []  # Currency at each index
+        self.capacity = capacity
+        self.adjacency = array('i', [-1]) * (capacity * capacity)
+        self.sources = array('H')
+        self.destinations = array('H')
+        self.weights = array('d')
+        self.rates = array('d')
+        self.timestamps = array('q')
+        self.columns = (self.sources, self.destinations, self.weights,
+                        self.rates, self.timestamps)
+        self.graph = _RateView(self)
+        self.edges = _EdgeView(self)
+
+    def _vertex_index(self, currency):
+        """
+        Gets the index of a currency, interning it if it is new
+        :param currency: Currency to look up
+        :return: Index of the currency
+        """
+        i = self.index.get(currency)
+        if i is None:
+            i = len(self.currencies)
+            if i == self.capacity:
+                self._grow()
+            self.index[currency] = i
+            self.currencies.append(currency)
+        return i
+
+    def _grow(self):
+        """
+        Doubles the capacity of the adjacency index
+        :return: None
+        """
+        old = self.capacity
+        capacity = 2 * old
+        adjacency = array('i', [-1]) * (capacity * capacity)
+        for u in range(old):
+            adjacency[u * capacity:u * capacity + old] = \
+                self.adjacency[u * old:(u + 1) * old]
+        self.capacity = capacity
+        self.adjacency = adjacency
+
+    def _slot(self, u, v):
+        """
+        Gets the slot of the edge from u to v
+        :param u: Index of the currency the edge leaves
+        :param v: Index of the currency the edge enters
+        :return: Slot of the edge, or -1 if there is none
+        """
+        return self.adjacency[u * self.capacity + v]
+
+    def add_to_graph(self, message):
+        """
+        Deciphers and adds a quote to the graph
+        :param message: Quote to be added to graph (list format), with its
+                        timestamp in microseconds since the epoch
+        :return: None
+        """
+        micros, c1, c2, rate = message
+        u = self._vertex_index(c1)
+        v = self._vertex_index(c2)
+        log_rate = log(rate, 10)
+        self._store_edge(u, v, -log_rate, rate, micros)
+        self._store_edge(v, u, log_rate, -rate, micros)
+        heapq.heappush(self.expiry, micros << 32 | u << 16 | v)
+
+    def _store_edge(self, u, v, weight, rate, micros):
+        """
+        Writes an edge into its slot, adding a slot if the edge is new, and
+        keeps track of what an incremental run needs to look at again
+        :param u: Index of the currency the edge leaves
+        :param v: Index of the currency the edge enters
+        :param weight: -log base 10 of the rate from u to v
+        :param rate: Signed rate, as stored in BellmanFord.graph
+        :param micros: Timestamp of the quote
+        :return: None
+        """
+        slot = self._slot(u, v)
+        if slot < 0:
+            self.adjacency[u * self.capacity + v] = len(self.weights)
+            self.sources.append(u)
+            self.destinations.append(v)
+            self.weights.append(weight)
+            self.rates.append(rate)
+            self.timestamps.append(micros)
+            old_weight = None
+        else:
+            old_weight = self.weights[slot]
+            self.weights[slot] = weight
+            self.rates[slot] = rate
+            self.timestamps[slot] = micros
+
+        self._track_change(self.currencies[u], self.currencies[v], old_weight,
+                           weight)
+
+    def _delete_edge(self, u, v):
+        """
+        Removes an edge, moving the last slot into its place
+        :param u: Index of the currency the edge leaves
+        :param v: Index of the currency the edge enters
+        :return: None
+        """
+        capacity = self.capacity
+        slot = self.adjacency[u * capacity + v]
+        self.adjacency[u * capacity + v] = -1
+        last = len(self.weights) - 1
+        if slot != last:
+            for column in self.columns:
+                column[slot] = column[last]
+            self.adjacency[self.sources[slot] * capacity
+                           + self.destinations[slot]] = slot
+        for column in self.columns:
+            column.pop()
+
+        self._track_removal(self.currencies[u], self.currencies[v])
+
+    def remove_stale_quotes(self, now=None):
+        """
+        Removes stale quotes (older than stale_after seconds) from the graph
+        :param now: Current time in microseconds since the epoch, read from
+                    the clock if not given
+        :return: List of the crosses removed, as (c1, c2) tuples
+        """
+        removed = []
+        expiry = self.expiry
+        if not expiry:
+            return removed
+        if now is None:
+            now = self.clock.now()
+        cutoff = now - self.stale_after << 32
+        while expiry and expiry[0] < cutoff:
+            entry = heapq.heappop(expiry)
+            micros = entry >> 32
+            u = entry >> 16 & 0xFFFF
+            v = entry & 0xFFFF
+            slot = self._slot(u, v)
+            # Skip entries for crosses quoted again (either way round) since
+            if slot < 0 or self.timestamps[slot] != micros:
+                continue
+            self._delete_edge(u, v)
+            self._delete_edge(v, u)
+            removed.append((self.currencies[u], self.currencies[v]))
+        return removed
+
+    def get_vertices(self):
+        """
+        Returns all vertices of the graph
+        :return: All vertices of the graph
+        """
+        return self.index.keys()
+
+    def get_exchange_rate(self, curr1, curr2):
+        """
+        Gets the exchange rate (edge) between curr1 to curr2
+        :param curr1: First currency
+        :param curr2: Second currency
+        :return: Exchange rate (edge) between the two currencies
+        """
+        slot = self._slot(self.index[curr1], self.index[curr2])
+        if slot < 0:
+            raise KeyError(curr2)
+        return self.rates[slot]
+
+    def _relax(self, dist, prev, rounds, tolerance):
+        """
+        Runs up to the given number of passes over the edge columns, stopping
+        early once a pass relaxes nothing
+        :param dist: List of distances by vertex index, updated in place
+        :param prev: List of predecessor indexes (-1 for none), updated in
+                     place
+        :param rounds: Maximum number of passes
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed
+        :return: True if the last pass still relaxed an edge
+        """
+        sources, destinations, weights = (self.sources, self.destinations,
+                                          self.weights)
+        relaxed = False
+        for _ in range(rounds):
+            relaxed = False
+            for u, v, weight in zip(sources, destinations, weights):
+                candidate = dist[u] + weight
+                if dist[v] - candidate >= tolerance:
+                    dist[v] = candidate
+                    prev[v] = u
+                    relaxed = True
+            if not relaxed:
+                break
+        return relaxed
+
+    def _find_cycle(self, dist, prev, tolerance):
+        """
+        Looks for an edge that can still be relaxed and traces the cycle
+        behind it
+        :param dist: List of distances by vertex index
+        :param prev: List of predecessor indexes, updated with the edge
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed
+        :return: The cycle in reverse order as a list of currencies, or an
+                 empty list
+        """
+        currencies = self.currencies
+        prev_dict = self._prev_dict(prev)
+        for u, v, weight in zip(self.sources, self.destinations,
+                                self.weights):
+            if dist[v] - (dist[u] + weight) >= tolerance:
+                prev[v] = u
+                prev_dict[currencies[v]] = currencies[u]
+                cycle = self._walk_to_cycle(prev_dict, currencies[v],
+                                            len(dist))
+                if cycle:
+                    return cycle
+        return []
+
+    def _prev_dict(self, prev):
+        """
+        Converts a list of predecessor indexes to a dictionary of currencies
+        :param prev: List of predecessor indexes (-1 for none)
+        :return: Dictionary of the predecessor currency of each currency
+        """
+        currencies = self.currencies
+        return {currencies[i]: currencies[p] if p >= 0 else None
+                for i, p in enumerate(prev)}
+
+    def shortest_paths(self, start_vertex, tolerance=0.0001):
+        """
+        Array version of BellmanFord.shortest_paths
+        :param start_vertex: start of all paths
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed
+        :return: distance, predecessor, negative_cycle, cycle in the same
+                 form as BellmanFord.shortest_paths
+        """
+        n = len(self.currencies)
+        dist = [float('Inf')] * n
+        dist[self.index[start_vertex]] = 0
+        prev = [-1] * n
+        self._relax(dist, prev, n - 1, tolerance)
+        cycle = self._find_cycle(dist, prev, tolerance)
+        negative_edge = (cycle[1], cycle[0]) if cycle else None
+        return (dict(zip(self.currencies, dist)), self._prev_dict(prev),
+                negative_edge, cycle)
+
+    def find_negative_cycle(self, tolerance=0.0001, incremental=False):
+        """
+        Array version of BellmanFord.find_negative_cycle. Incremental runs
+        repair the distances through the dictionary views, as they only touch
+        a few edges.
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed
+        :param incremental: repair the distances of the last run instead of
+                            starting over
+        :return: distance, predecessor, negative_cycle, cycle in the same
+                 form as BellmanFord.find_negative_cycle
+        """
+        if incremental and self.potential_valid:
+            return self._repair_potential(tolerance)
+
+        n = len(self.currencies)
+        dist = [0.0] * n
+        prev = [-1] * n
+        self.changed_edges.clear()
+        self.potential_valid = False
+        self.settled = None
+        self.excluded = set()
+
+        relaxed = self._relax(dist, prev, n, tolerance)
+        if relaxed:
+            cycle = self._find_cycle(dist, prev, tolerance)
+            if cycle:
+                return (dict(zip(self.currencies, dist)),
+                        self._prev_dict(prev), (cycle[1], cycle[0]), cycle)
+
+        dist = dict(zip(self.currencies, dist))
+        prev = self._prev_dict(prev)
+        # Only distances of a run that relaxed nothing in its last pass are
+        # final, as in BellmanFord
+        if not relaxed:
+            self.potential = dist
+            self.potential_prev = prev
+            self.potential_valid = True
+        return dist, prev, None, []
+
+
+class _EdgeView(Mapping):
+    """
+    Read-only view of the edge weights of a CompactBellmanFord, keyed by
+    (c1, c2) like BellmanFord.edges
+    """
+    def __init__(self, g):
+        self.g = g
+
+    def __getitem__(self, edge):
+        g = self.g
+        slot = g._slot(g.index[edge[0]], g.index[edge[1]])
+        if slot < 0:
+            raise KeyError(edge)
+        return g.weights[slot]
+
+    def __iter__(self):
+        currencies = self.g.currencies
+        for u, v in zip(self.g.sources, self.g.destinations):
+            yield currencies[u], currencies[v]
+
+    def __len__(self):
+        return len(self.g.weights)
+
+
+class _RateView(Mapping):
+    """
+    Read-only view of the rates of a CompactBellmanFord, keyed by currency
+    and then by currency like BellmanFord.graph
+    """
+    def __init__(self, g):
+        self.g = g
+
+    def __getitem__(self, currency):
+        return _RateRowView(self.g, self.g.index[currency])
+
+    def __iter__(self):
+        return iter(self.g.currencies)
+
+    def __len__(self):
+        return len(self.g.currencies)
+
+
+class _RateRowView(Mapping):
+    """
+    Read-only view of the rates of the edges leaving one vertex
+    """
+    def __init__(self, g, u):
+        self.g = g
+        self.u = u
+
+    def __getitem__(self, currency):
+        return self.g.get_exchange_rate(self.g.currencies[self.u], currency)
+
+    def __iter__(self):
+        g = self.g
+        start = self.u * g.capacity
+        row = g.adjacency[start:start + len(g.currencies)]
+        for v, slot in enumerate(row):
+            if slot >= 0:
+                yield g.currencies[v]
+
+    def __len__(self):
+        return sum(1 for _ in self)
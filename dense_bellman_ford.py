@@ -0,0 +1,202 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+"""
+from bellman_ford import BellmanFord
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for this engine
+    np = None
+
+
+class DenseBellmanFord(BellmanFord):
+    """
+    Alternative to BellmanFord for large numbers of currencies. Every
+    currency gets an index and the edge weights are also kept in a dense
+    NumPy matrix, where weights[i, j] is -log base 10 of the rate from
+    currency i to currency j (infinity if there is no quote). Each round of
+    relaxation is then a single vectorized min-plus operation over the whole
+    matrix instead of a Python loop over the edges.
+
+    Results come back in the same form as the BellmanFord functions, so the
+    two can be used interchangeably.
+    """
+    def __init__(self, stale_after=1.5, capacity=16, clock_source=None):
+        """
+        Constructs a DenseBellmanFord object
+        :param stale_after: Seconds after which a quote is stale
+        :param capacity: Number of currencies to make room for up front, the
+                         matrix grows as needed
+        :param clock_source: Clock stale quotes are judged by, as in
+                             BellmanFord
+        """
+        if np is None:
+            raise ImportError('DenseBellmanFord requires numpy')
+        super().__init__(stale_after, clock_source)
+        self.index = {}  # Index of each currency in the matrix
+        self.currencies = []  # Currency at each index
+        self.weights = np.full((capacity, capacity), np.inf)
+
+    def _vertex_index(self, currency):
+        """
+        Gets the index of a currency, adding it to the matrix if it is new
+        :param currency: Currency to look up
+        :return: Index of the currency
+        """
+        i = self.index.get(currency)
+        if i is None:
+            i = len(self.currencies)
+            if i == len(self.weights):
+                grown = np.full((2 * i, 2 * i), np.inf)
+                grown[:i, :i] = self.weights
+                self.weights = grown
+            self.index[currency] = i
+            self.currencies.append(currency)
+        return i
+
+    def _set_edge(self, c1, c2, weight):
+        """
+        Stores the weight of the directed edge from c1 to c2 in the edge
+        store and the matrix
+        :param c1: Currency the edge leaves
+        :param c2: Currency the edge enters
+        :param weight: -log base 10 of the rate from c1 to c2
+        :return: None
+        """
+        super()._set_edge(c1, c2, weight)
+        i = self._vertex_index(c1)
+        j = self._vertex_index(c2)
+        self.weights[i, j] = weight
+
+    def _remove_edge(self, c1, c2):
+        """
+        Removes the directed edge from c1 to c2 from the edge store and the
+        matrix
+        :param c1: Currency the edge leaves
+        :param c2: Currency the edge enters
+        :return: None
+        """
+        super()._remove_edge(c1, c2)
+        self.weights[self.index[c1], self.index[c2]] = np.inf
+
+    def adopt(self, version):
+        """
+        Version of BellmanFord.adopt that also brings the matrix up to date
+        with the edges that changed
+        :param version: GraphVersion to search
+        :return: Set of the crosses that changed, as in BellmanFord.adopt
+        """
+        crosses = super().adopt(version)
+        for c1, c2 in crosses:
+            i = self._vertex_index(c1)
+            j = self._vertex_index(c2)
+            self.weights[i, j] = self.edges.get((c1, c2), np.inf)
+            self.weights[j, i] = self.edges.get((c2, c1), np.inf)
+        return crosses
+
+    def _relax(self, dist, prev, rounds, tolerance):
+        """
+        Runs up to the given number of relaxation rounds over the matrix,
+        stopping early once a round improves nothing
+        :param dist: Array of distances, updated in place
+        :param prev: Array of predecessor indexes (-1 for none), updated in
+                     place
+        :param rounds: Maximum number of rounds
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed
+        :return: Boolean array of the vertices improved by the last round
+        """
+        n = len(dist)
+        weights = self.weights[:n, :n]
+        columns = np.arange(n)
+        improved = np.zeros(n, dtype=bool)
+        for _ in range(rounds):
+            # candidates[i, j] is the distance to j going through i last
+            candidates = dist[:, None] + weights
+            best = candidates.argmin(axis=0)
+            best_dist = candidates[best, columns]
+            # Unreachable vertices give inf - inf, which is never an
+            # improvement
+            with np.errstate(invalid='ignore'):
+                improved = dist - best_dist >= tolerance
+            if not improved.any():
+                break
+            dist[improved] = best_dist[improved]
+            prev[improved] = best[improved]
+        return improved
+
+    def _results(self, dist, prev, improved):
+        """
+        Converts the arrays of a run back into the result form of the
+        BellmanFord functions, tracing a cycle if a vertex could still be
+        improved
+        :param dist: Array of distances
+        :param prev: Array of predecessor indexes
+        :param improved: Boolean array of vertices improved by the last round
+        :return: distance, predecessor, negative_cycle, cycle
+        """
+        n = len(dist)
+        currencies = self.currencies
+        dist_dict = dict(zip(currencies, dist.tolist()))
+        prev_dict = {currencies[i]: currencies[p] if p >= 0 else None
+                     for i, p in enumerate(prev.tolist())}
+        cycle = []
+        negative_edge = None
+        for vertex in np.flatnonzero(improved).tolist():
+            cycle = self._walk_to_cycle(prev_dict, currencies[vertex], n)
+            if cycle:
+                negative_edge = (cycle[1], cycle[0])
+                break
+        return dist_dict, prev_dict, negative_edge, cycle
+
+    def shortest_paths(self, start_vertex, tolerance=0.0001):
+        """
+        Vectorized version of BellmanFord.shortest_paths
+        :param start_vertex: start of all paths
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed
+        :return: distance, predecessor, negative_cycle, cycle in the same
+                 form as BellmanFord.shortest_paths
+        """
+        n = len(self.currencies)
+        dist = np.full(n, np.inf)
+        dist[self.index[start_vertex]] = 0
+        prev = np.full(n, -1)
+        self._relax(dist, prev, n - 1, tolerance)
+
+        # Additional round to find if a negative edge exists, on a copy so
+        # the distances stay those of the first n - 1 rounds
+        check_prev = prev.copy()
+        improved = self._relax(dist.copy(), check_prev, 1, tolerance)
+        return self._results(dist, check_prev, improved)
+
+    def find_negative_cycle(self, tolerance=0.0001, incremental=False):
+        """
+        Vectorized version of BellmanFord.find_negative_cycle. Each call is a
+        full run, as a round over the matrix costs about the same no matter
+        how few quotes changed, but the distances of a run without a cycle
+        are kept for potential_holds.
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed
+        :param incremental: accepted for compatibility with BellmanFord and
+                            ignored
+        :return: distance, predecessor, negative_cycle, cycle in the same
+                 form as BellmanFord.find_negative_cycle
+        """
+        n = len(self.currencies)
+        dist = np.zeros(n)
+        prev = np.full(n, -1)
+        self.changed_edges.clear()
+        self.potential_valid = False
+        self.settled = None
+        self.excluded = set()
+        improved = self._relax(dist, prev, n, tolerance)
+        result = self._results(dist, prev, improved)
+        if not improved.any():
+            # Kept so potential_holds can tell when a run can be skipped
+            self.potential, self.potential_prev = result[0], result[1]
+            self.potential_valid = True
+        return result
@@ -0,0 +1,264 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+
+Output of the subscriber's events (quotes, out-of-sequence quotes, stale
+removals and arbitrage opening and closing) kept off the hot path. An event
+is a tuple of its kind and its fields, which the analysis only has to append
+to a buffer; turning it into text and writing it is done later, on a
+background thread unless output is synchronous.
+
+Events and their fields:
+
+    quote      microseconds since the epoch, currency 1, currency 2, price
+    ignored    (none), an out-of-sequence quote
+    stale      cross removed, as a (currency 1, currency 2) tuple
+    arbitrage  vertices of the cycle, conversion rate of each step, and
+               with overlap the number and time of the graph version it was
+               found in
+    closed     vertices of the cycle, seconds it was open
+    log        message
+"""
+import json
+import select
+import sys
+import threading
+from collections import Counter, deque
+
+from clock import micros_to_datetime
+
+PIPE_BUF = getattr(select, 'PIPE_BUF', 512)  # largest atomic write to a pipe
+
+
+def format_text(event):
+    """
+    Formats an event as the subscriber has always printed it
+
+    >>> print(format_text(('quote', 1136160000000000, 'GBP', 'USD', 1.22041)))
+    2006-01-02 00:00:00 GBP USD 1.22041
+    >>> arbitrage = ('arbitrage', ['USD', 'JPY', 'USD'], [100.0, 0.0105])
+    >>> print(format_text(arbitrage))  # doctest: +NORMALIZE_WHITESPACE
+    ARBITRAGE:
+    	 start with USD 100
+    	 USD for JPY at 100.0 --> JPY 10000.0
+    	 JPY for USD at 0.0105 --> USD 105.0
+
+    :param event: Tuple of the kind of event and its fields
+    :return: Lines of text, without the final newline
+    """
+    kind = event[0]
+    if kind == 'quote':
+        return '{} {} {} {}'.format(micros_to_datetime(event[1]), *event[2:])
+    if kind == 'ignored':
+        return 'ignoring out-of-sequence message'
+    if kind == 'stale':
+        return 'removing stale quote for {}'.format(event[1])
+    if kind == 'arbitrage':
+        path, rates = event[1], event[2]
+        header = 'ARBITRAGE:'
+        if len(event) > 3:
+            header = 'ARBITRAGE in graph version {} of {}:'.format(
+                event[3], micros_to_datetime(event[4]))
+        lines = [header, '\t start with {} 100'.format(path[0])]
+        value = 100
+        for i, rate in enumerate(rates):
+            value *= rate
+            lines.append('\t {} for {} at {} --> {} {}'.format(
+                path[i], path[i + 1], rate, path[i + 1], value))
+        return '\n'.join(lines)
+    if kind == 'closed':
+        return 'ARBITRAGE CLOSED after {:.3f}s: {}'.format(
+            event[2], ' '.join(event[1]))
+    return str(event[1])
+
+
+def format_json(event):
+    """
+    Formats an event as one line of JSON
+
+    >>> print(format_json(('stale', ('GBP', 'USD'))))
+    {"event": "stale", "cross": ["GBP", "USD"]}
+
+    :param event: Tuple of the kind of event and its fields
+    :return: JSON object of the event on one line
+    """
+    kind = event[0]
+    if kind == 'quote':
+        record = {'time': micros_to_datetime(event[1]).isoformat(),
+                  'c1': event[2], 'c2': event[3], 'price': event[4]}
+    elif kind == 'stale':
+        record = {'cross': event[1]}
+    elif kind == 'arbitrage':
+        record = {'cycle': event[1], 'rates': event[2]}
+        if len(event) > 3:
+            record['version'] = event[3]
+            record['as_of'] = micros_to_datetime(event[4]).isoformat()
+    elif kind == 'closed':
+        record = {'cycle': event[1], 'seconds': event[2]}
+    elif kind == 'log':
+        record = {'message': event[1]}
+    else:
+        record = {}
+    return json.dumps(dict(event=kind, **record))
+
+
+FORMATS = {
+    'text': format_text,
+    'json': format_json,
+}
+
+
+class PrintSink(object):
+    """
+    Writes every event as soon as it happens, as print would
+    """
+    def __init__(self, formatter=format_text, file=None):
+        """
+        :param formatter: Function turning an event into its text
+        :param file: File to write to, whatever standard output is at the
+                     time if not given
+        """
+        self.formatter = formatter
+        self.file = file
+        self.dropped = 0
+
+    def emit(self, *event):
+        """
+        Writes an event
+        :param event: Kind of the event followed by its fields
+        :return: None
+        """
+        (self.file or sys.stdout).write(self.formatter(event) + '\n')
+
+    def close(self):
+        """
+        Flushes the output
+        :return: None
+        """
+        (self.file or sys.stdout).flush()
+
+
+class ThreadedSink(object):
+    """
+    Buffers events in a bounded ring and writes them from a background thread
+    in batches, so the caller never waits for the terminal. When the ring is
+    full new events are dropped and counted rather than blocking.
+    """
+    def __init__(self, formatter=format_text, file=None, capacity=65536,
+                 interval=0.05):
+        """
+        :param formatter: Function turning an event into its text
+        :param file: File to write to, standard output if not given
+        :param capacity: Most events waiting to be written
+        :param interval: Seconds between batches of writes
+        """
+        self.formatter = formatter
+        self.file = file or sys.stdout
+        self.capacity = capacity
+        self.interval = interval
+        self.buffer = deque()
+        self.dropped = 0
+        self.stopping = threading.Event()
+        self.writer = threading.Thread(target=self._write_batches,
+                                       name='event-sink', daemon=True)
+        self.writer.start()
+
+    def emit(self, *event):
+        """
+        Queues an event to be written
+        :param event: Kind of the event followed by its fields
+        :return: None
+        """
+        if len(self.buffer) >= self.capacity:
+            self.dropped += 1
+        else:
+            self.buffer.append(event)
+
+    def _write_batches(self):
+        """
+        Runs on the writer thread, writing whatever has been queued every
+        interval until the sink is closed
+        :return: None
+        """
+        while not self.stopping.wait(self.interval):
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        """
+        Writes every queued event, in chunks of whole lines no longer than a
+        pipe writes atomically, so that lines from other processes sharing
+        the output (the analyzers) are never cut into
+        :return: None
+        """
+        buffer, formatter, file = self.buffer, self.formatter, self.file
+        chunk, size = [], 0
+        while buffer:
+            line = formatter(buffer.popleft()) + '\n'
+            if size + len(line) > PIPE_BUF and chunk:
+                file.write(''.join(chunk))
+                file.flush()
+                chunk, size = [], 0
+            chunk.append(line)
+            size += len(line)
+        if chunk:
+            file.write(''.join(chunk))
+            file.flush()
+
+    def close(self):
+        """
+        Writes what is still queued and stops the writer thread, reporting
+        how many events were dropped, if any
+        :return: None
+        """
+        self.stopping.set()
+        self.writer.join()
+        if self.dropped:
+            print('{} events dropped'.format(self.dropped), file=sys.stderr)
+
+
+class NullSink(object):
+    """
+    Stand-in for a sink where nothing is to be written, such as an analyzer
+    process that leaves the reporting to another
+    """
+    dropped = 0
+
+    def emit(self, *event):
+        pass
+
+    def close(self):
+        pass
+
+
+class CountingSink(NullSink):
+    """
+    Sink that only counts the events of each kind, for measuring the
+    subscriber without writing anything
+
+    >>> sink = CountingSink()
+    >>> sink.emit('quote', 0, 'GBP', 'USD', 1.25)
+    >>> sink.emit('ignored')
+    >>> sink.emit('quote', 1, 'GBP', 'USD', 1.26)
+    >>> sink.counts['quote'], sink.counts['arbitrage']
+    (2, 0)
+    """
+    def __init__(self):
+        self.counts = Counter()  # Number of events by kind
+
+    def emit(self, *event):
+        self.counts[event[0]] += 1
+
+
+def make_sink(output='text', capacity=65536):
+    """
+    Makes the sink for the subscriber's command line options
+    :param output: Name of the format in FORMATS
+    :param capacity: Size of the ring buffer, 0 to write synchronously
+    :return: ThreadedSink, or PrintSink when capacity is 0
+    """
+    if capacity:
+        return ThreadedSink(FORMATS[output], capacity=capacity)
+    return PrintSink(FORMATS[output])
@@ -4,11 +4,15 @@ Forex Provider
 
 This module implements a staging version the Forex Provider price feed on localhost.
 """
+import argparse
+import atexit
 import socket
 import selectors
-from datetime import datetime, timedelta
+from heapq import heappop, heappush
 import time
 import random
+import clock
+import event_sink
 import fxp_bytes
 
 
@@ -16,32 +20,134 @@ REQUEST_ADDRESS = ('localhost', 63000)
 REQUEST_SIZE = 12
 REVERSE_QUOTED = {'GBP', 'EUR', 'AUD'}
 SUBSCRIPTION_TIME = 19  # 10 * 60  # seconds
+MODES = ('steady', 'poisson', 'bursty')
+MAX_LAG = 1.0  # seconds behind schedule before the schedule is reset rather than caught up
 
 
 class TestPublisher(object):
     """
     Publishes occasional messages
     """
-    def __init__(self):
-        self.subscriptions = {}
+    def __init__(self, reference=None, arbitrage_rate=0.95, verbose=True, rate=1.0, mode='steady',
+                 burst=10, clock_source=None):
+        """
+        :param reference: starting price of each currency against USD (defaults to a few majors)
+        :param arbitrage_rate: chance of putting an arbitrage in each message
+        :param verbose: print what is being published, from a background thread
+        :param rate: average messages per second
+        :param mode: 'steady' for evenly spaced messages, 'poisson' for random arrivals at that
+                     average rate, 'bursty' for back-to-back bursts with quiet gaps between them
+        :param burst: messages per burst in bursty mode
+        :param clock_source: clock that timestamps messages and times subscriptions out, in microseconds since
+                             the epoch (see clock.py), the system clock if not given
+        """
+        if mode not in MODES:
+            raise ValueError('mode must be one of {}'.format(MODES))
+        self.clock = clock_source or clock.SYSTEM
+        self.subscriptions = {}  # registration time (microseconds) by subscriber address
+        self.expiry = []  # heap of (registration time, subscriber), oldest first
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.reference = {'GBP': 1.25, 'JPY': 100.0, 'EUR': 1.10, 'CHF': 1.00, 'AUD': 0.75}
+        # a subscriber that can't keep up must not hold up everyone else
+        self.socket.setblocking(False)
+        self.dropped = 0  # messages not sent because the socket buffer was full
+        if reference is None:
+            reference = {'GBP': 1.25, 'JPY': 100.0, 'EUR': 1.10, 'CHF': 1.00, 'AUD': 0.75}
+        self.reference = reference
+        self.arbitrage_rate = arbitrage_rate
+        self.verbose = verbose
+        self.sink = event_sink.ThreadedSink() if verbose else None
+        if self.sink is not None:
+            atexit.register(self.sink.close)
+        self.encoder = fxp_bytes.MessageEncoder()
+        self.rate = rate
+        self.mode = mode
+        self.burst = burst
+        self.burst_left = burst
+
+    def log(self, message):
+        if self.verbose:
+            self.sink.emit('log', message)
 
     def register_subscription(self, subscriber):
-        print('registering subscription for {}'.format(subscriber))
-        self.subscriptions[subscriber] = datetime.utcnow()
+        self.log('registering subscription for {}'.format(subscriber))
+        ts = self.clock.now()
+        self.subscriptions[subscriber] = ts
+        heappush(self.expiry, (ts, subscriber))
 
-    def publish(self):
-        # remove expired subscriptions
-        ts = datetime.utcnow()
-        for subscriber in set(self.subscriptions):
-            if (ts - self.subscriptions[subscriber]).total_seconds() >= SUBSCRIPTION_TIME:
-                print('{} subscription expired'.format(subscriber))
+    def expire_subscriptions(self, ts):
+        """
+        Remove the subscriptions that have run out, looking only at the oldest ones.
+        A renewed subscription leaves its old heap entry behind, which is skipped
+        when it comes up because it no longer matches the registration time.
+
+        :param ts: current time in microseconds since the epoch
+        """
+        cutoff = ts - SUBSCRIPTION_TIME * clock.MICROS_PER_SECOND
+        while self.expiry and self.expiry[0][0] <= cutoff:
+            registered, subscriber = heappop(self.expiry)
+            if self.subscriptions.get(subscriber) == registered:
+                self.log('{} subscription expired'.format(subscriber))
                 del self.subscriptions[subscriber]
+
+    def publish(self):
+        ts = self.clock.now()
+        self.expire_subscriptions(ts)
         if len(self.subscriptions) == 0:
-            print('no subscriptions')
+            self.log('no subscriptions')
             return 1000.0  # nothing to do until we get a subscription, so we can wait a long time
 
+        quotes = self.next_quotes(ts)
+
+        # encode once and send the same bytes to every current subscriber
+        message = self.encoder.encode(quotes)
+        if self.verbose:
+            self.log('publishing {} to {} subscribers'.format(quotes, len(self.subscriptions)))
+        self.fan_out(message)
+        return self.next_interval()
+
+    def next_interval(self):
+        """
+        Pick the time to wait until the next message, according to the mode.
+
+        :return: seconds from this message to the next
+        """
+        if self.mode == 'poisson':
+            return random.expovariate(self.rate)
+        if self.mode == 'bursty':
+            self.burst_left -= 1
+            if self.burst_left > 0:
+                return 0.0
+            self.burst_left = self.burst
+            return self.burst / self.rate
+        return 1.0 / self.rate
+
+    def fan_out(self, message):
+        """
+        Send a message to every subscriber without blocking. Python has no sendmmsg,
+        so this is one sendto per subscriber on a non-blocking socket; when the
+        socket buffer is full the message is dropped for that subscriber, as UDP
+        would have done anyway.
+
+        :param message: encoded message
+        :return: number of subscribers it was sent to
+        """
+        sendto = self.socket.sendto
+        sent = 0
+        for subscriber in self.subscriptions:
+            try:
+                sendto(message, subscriber)
+                sent += 1
+            except BlockingIOError:
+                self.dropped += 1
+        return sent
+
+    def next_quotes(self, ts):
+        """
+        Random walk the reference prices and make up the quotes for the next message.
+
+        :param ts: current time in microseconds since the epoch, used as the base for out-of-order timestamps
+        :return: list of quote structures ('cross' and 'price', out-of-order ones also have 'timestamp')
+        """
         # random walk the prices
         quotes = []
         for ccy in self.reference:
@@ -56,8 +162,8 @@ class TestPublisher(object):
 
         # occasionally put in some older timestamps to simulate out-of-order UDP messages
         if random.random() < 0.10: # 10% of the time
-            print('sending an out of order message')
-            ts -= timedelta(seconds=random.gauss(10, 3), microseconds=random.gauss(200, 10))
+            self.log('sending an out of order message')
+            ts -= clock.seconds_to_micros(random.gauss(10, 3)) + round(random.gauss(200, 10))
             for quote in quotes:
                 quote['timestamp'] = ts
 
@@ -65,27 +171,19 @@ class TestPublisher(object):
         quotes = random.sample(quotes, k=len(quotes) - random.choice((0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 2, 3)))
 
         # occasionally put in an arbitrage
-        if random.random() < 0.95:  # 5% of the time
+        if random.random() < self.arbitrage_rate:
             xxx, yyy = sorted(random.sample(list(self.reference), 2))
             xxx_per_usd = self.reference[xxx] if xxx not in REVERSE_QUOTED else 1/self.reference[xxx]
             yyy_per_usd = self.reference[yyy] if yyy not in REVERSE_QUOTED else 1/self.reference[yyy]
             rate = (yyy_per_usd / xxx_per_usd) * random.gauss(1.0, 0.01)
             if random.random() < 0.5:
-                print('putting in a 3-way cycle')
+                self.log('putting in a 3-way cycle')
                 quotes.append({'cross': '{}/{}'.format(xxx, yyy), 'price': rate})
             else:
-                print('putting in a 4-way cycle')
+                self.log('putting in a 4-way cycle')
                 quotes.append({'cross': '{}/CAD'.format(xxx), 'price': rate/2})
                 quotes.append({'cross': 'CAD/{}'.format(yyy), 'price': rate*2})
-
-        # send the messages to current subscribers
-        message = fxp_bytes.marshal_message(quotes)
-        for subscriber in self.subscriptions:
-            print('publishing {} to {}'.format(quotes, subscriber))
-            self.socket.sendto(message, subscriber)
-
-        # pick a time to wait until the next message
-        return 1.0  # FIXME randomize quiet time
+        return quotes
 
 
 class ForexProvider(object):
@@ -93,24 +191,37 @@ class ForexProvider(object):
     Accept subscriptions for a new instance of a given publisher class.
     """
 
-    def __init__(self, request_address, publisher_class):
+    def __init__(self, request_address, publisher_class, **publisher_args):
         """
         :param request_address:
         :param publisher_class: publisher class must support publish and register_
+        :param publisher_args: keyword arguments for the publisher class
         """
         self.selector = selectors.DefaultSelector()
         self.subscription_requests = self.start_a_server(request_address)
         self.selector.register(self.subscription_requests, selectors.EVENT_READ)
-        self.publisher = publisher_class()
+        self.publisher = publisher_class(**publisher_args)
 
     def run_forever(self):
+        """
+        Publish on schedule while servicing subscription requests on the same selector.
+        Each publish returns the wait until the next one, which is added to the previous
+        deadline rather than to the current time, so time spent publishing doesn't make
+        the rate drift. Every message that is due is sent before selecting again, unless
+        the schedule falls more than MAX_LAG behind, when it starts over from now.
+        """
         print('waiting for subscribers on {}'.format(self.subscription_requests))
-        next_timeout = 0.2  # FIXME
+        deadline = time.monotonic()
         while True:
-            events = self.selector.select(next_timeout)
+            events = self.selector.select(max(0.0, deadline - time.monotonic()))
+            now = time.monotonic()
             for key, mask in events:
                 self.register_subscription()
-            next_timeout = self.publisher.publish()
+                deadline = min(deadline, now)  # start publishing to a new subscriber right away
+            if now - deadline > MAX_LAG:
+                deadline = now
+            while deadline <= now:
+                deadline += self.publisher.publish()
 
     def register_subscription(self):
         data, _address = self.subscription_requests.recvfrom(REQUEST_SIZE)
@@ -131,9 +242,20 @@ class ForexProvider(object):
 
 
 if __name__ == '__main__':
-    if REQUEST_ADDRESS[1] == 50403:
+    parser = argparse.ArgumentParser(description='Staging Forex Provider price feed')
+    parser.add_argument('--port', type=int, default=REQUEST_ADDRESS[1],
+                        help='port to take subscriptions on, one per venue when running several')
+    parser.add_argument('--rate', type=float, default=1.0, help='average messages per second')
+    parser.add_argument('--mode', choices=MODES, default='steady')
+    parser.add_argument('--burst', type=int, default=10, help='messages per burst in bursty mode')
+    parser.add_argument('--arbitrage-rate', type=float, default=0.95,
+                        help='chance of putting an arbitrage in each message')
+    parser.add_argument('--quiet', action='store_true', help="don't print what is published")
+    args = parser.parse_args()
+    if args.port == 50403:
         print('Pick your own port for testing!')
         print('Modify REQUEST_ADDRESS above to use localhost and some random port')
         exit(1)
-    fxp = ForexProvider(REQUEST_ADDRESS, TestPublisher)
+    fxp = ForexProvider((REQUEST_ADDRESS[0], args.port), TestPublisher, arbitrage_rate=args.arbitrage_rate,
+                        verbose=not args.quiet, rate=args.rate, mode=args.mode, burst=args.burst)
     fxp.run_forever()
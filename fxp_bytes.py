@@ -5,11 +5,21 @@ Forex Provider
 This module contains useful marshalling functions for manipulating Forex Provider packet contents.
 """
 import ipaddress
+import struct
 from array import array
 from datetime import datetime
 
+import clock
+
 MAX_QUOTES_PER_MESSAGE = 50
-MICROS_PER_SECOND = 1_000_000
+QUOTE_SIZE = 32  # bytes per quote record
+PRICE_OFFSET = 14  # bytes from the start of a record to its price
+
+# timestamp is big-endian but price is little-endian, so they need two structs
+TIMESTAMP_AND_CROSS = struct.Struct('>Q6s')
+PRICE = struct.Struct('<d')
+
+_cross_bytes = {}  # 6-byte encodings of crosses already seen, keyed by 'XXX/YYY'
 
 
 def serialize_price(x: float) -> bytes:
@@ -55,13 +65,21 @@ def serialize_utcdatetime(utc: datetime) -> bytes:
     :param utc: timestamp to convert to desired byte format
     :return: 8-byte stream
     """
-    epoch = datetime(1970, 1, 1)
-    micros = (utc - epoch).total_seconds() * MICROS_PER_SECOND
-    a = array('Q', [int(micros)])
+    a = array('Q', [_utc_micros(utc)])
     a.byteswap()  # convert to big-endian
     return a.tobytes()
 
 
+def _utc_micros(utc) -> int:
+    """
+    Microseconds since 00:00:00 UTC on 1 January 1970 for a UTC datetime, or the timestamp itself if it is already
+    an integer number of microseconds.
+    """
+    if isinstance(utc, int):
+        return utc
+    return clock.utc_micros(utc)
+
+
 def marshal_message(quote_sequence) -> bytes:
     """
     Construct the byte stream for a message with given quote_sequence.
@@ -80,16 +98,68 @@ def marshal_message(quote_sequence) -> bytes:
     """
     if len(quote_sequence) > MAX_QUOTES_PER_MESSAGE:
         raise ValueError('max quotes exceeded for a single message')
-    message = bytes()
-    default_time = serialize_utcdatetime(datetime.utcnow())
-    padding = b'\x00' * 10  # 10 bytes of zeros
+    message = bytearray(QUOTE_SIZE * len(quote_sequence))
+    pack_quotes(message, quote_sequence)
+    return bytes(message)
+
+
+def pack_quotes(buffer, quote_sequence) -> int:
+    """
+    Pack the records for quote_sequence into the start of buffer. Padding
+    bytes are not written, so they have to be zero already.
+
+    :param buffer: writable buffer with room for all the records
+    :param quote_sequence: list of quote structures ('cross' and 'price', may also have 'timestamp', either a UTC
+                           datetime or microseconds since the epoch)
+    :return: number of bytes written
+    """
+    default_time = None
+    last_timestamp = last_micros = None
+    offset = 0
     for quote in quote_sequence:
         if 'timestamp' in quote:
-            message += serialize_utcdatetime(quote['timestamp'])
+            # quotes in a message usually share one timestamp, so only convert it once
+            timestamp = quote['timestamp']
+            if timestamp != last_timestamp:
+                last_timestamp = timestamp
+                last_micros = _utc_micros(timestamp)
+            micros = last_micros
         else:
-            message += default_time
-        message += quote['cross'][0:3].encode('utf-8')
-        message += quote['cross'][4:7].encode('utf-8')
-        message += serialize_price(quote['price'])
-        message += padding
-    return message
+            if default_time is None:
+                default_time = clock.SYSTEM.now()
+            micros = default_time
+        cross = quote['cross']
+        cross_bytes = _cross_bytes.get(cross)
+        if cross_bytes is None:
+            cross_bytes = (cross[0:3] + cross[4:7]).encode('utf-8')
+            _cross_bytes[cross] = cross_bytes
+        TIMESTAMP_AND_CROSS.pack_into(buffer, offset, micros, cross_bytes)
+        PRICE.pack_into(buffer, offset + PRICE_OFFSET, quote['price'])
+        offset += QUOTE_SIZE
+    return offset
+
+
+class MessageEncoder(object):
+    """
+    Reusable encoder for callers sending many messages, which packs every
+    message into the same preallocated buffer instead of allocating a new one.
+
+    >>> encoder = MessageEncoder()
+    >>> quotes = [{'timestamp': datetime(2006,1,2), 'cross': 'GBP/USD', 'price': 1.22041}]
+    >>> bytes(encoder.encode(quotes)) == marshal_message(quotes)
+    True
+    """
+    def __init__(self):
+        self.buffer = bytearray(QUOTE_SIZE * MAX_QUOTES_PER_MESSAGE)
+        self.view = memoryview(self.buffer)
+
+    def encode(self, quote_sequence) -> memoryview:
+        """
+        Construct the byte stream for a message with given quote_sequence.
+
+        :param quote_sequence: list of quote structures ('cross' and 'price', may also have 'timestamp')
+        :return: view of the message in the encoder's buffer, only valid until the next call
+        """
+        if len(quote_sequence) > MAX_QUOTES_PER_MESSAGE:
+            raise ValueError('max quotes exceeded for a single message')
+        return self.view[:pack_quotes(self.buffer, quote_sequence)]
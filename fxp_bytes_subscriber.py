@@ -5,10 +5,21 @@ This is free and unencumbered software released into the public domain.
 :Version: Fall2020
 """
 import string
-from datetime import datetime, timedelta
+import sys
+from datetime import datetime
 import struct
 
-MICROS_PER_SECOND = 1_000_000
+from clock import micros_to_datetime
+
+QUOTE_SIZE = 32  # Bytes per quote in a datagram
+
+# A quote is a big-endian timestamp, the two currencies, a little-endian price
+# and padding. struct cannot mix byte orders in one format, so each of these
+# reads the whole 32 byte record and skips the part it does not need.
+TIMESTAMP_AND_CROSS = struct.Struct('>Q6s18x')
+PRICE = struct.Struct('<14xd10x')
+
+_crosses = {}  # Interned (c1, c2) pairs keyed by their 6 bytes
 
 
 def serialize_address(ip: string, port: int) -> bytes:
@@ -43,12 +54,8 @@ def deserialize_utcdatetime(b: bytes) -> datetime:
     :param b: byte sequence of UTC datetime
     :return: datetime timestamp
     """
-    epoch = datetime(1970, 1, 1)
     p = struct.unpack('>Q', b)
-    microseconds = p[0]
-    seconds = microseconds / MICROS_PER_SECOND
-    deserialized_time = epoch + timedelta(seconds=seconds)
-    return deserialized_time
+    return micros_to_datetime(p[0])
 
 
 def unmarshal_message(b: bytes) -> list:
@@ -67,3 +74,43 @@ def unmarshal_message(b: bytes) -> list:
     unmarshalled_message_list.append(currencies[3:])
     unmarshalled_message_list.append(conversion)
     return unmarshalled_message_list
+
+
+def intern_cross(b: bytes) -> tuple:
+    """
+    Decodes the 6 bytes of the two currencies in a quote, reusing the same
+    interned strings every time the cross comes up
+    :param b: The 6 currency bytes of a quote
+    :return: Tuple of the two currencies
+    """
+    cross = _crosses.get(b)
+    if cross is None:
+        currencies = b.decode('utf-8')
+        cross = (sys.intern(currencies[0:3]), sys.intern(currencies[3:]))
+        _crosses[b] = cross
+    return cross
+
+
+def unmarshal_messages(data: bytes) -> list:
+    """
+    Decodes every quote in a datagram at once, without slicing the datagram
+    into a copy per quote. Any incomplete quote at the end is ignored.
+
+    >>> import fxp_bytes
+    >>> data = fxp_bytes.marshal_message([ \
+            {'timestamp': datetime(2006, 1, 2), 'cross': 'GBP/USD', 'price': 1.22041}, \
+            {'timestamp': datetime(2006, 1, 1), 'cross': 'USD/JPY', 'price': 108.2755}])
+    >>> unmarshal_messages(data)
+    [(1136160000000000, 'GBP', 'USD', 1.22041), (1136073600000000, 'USD', 'JPY', 108.2755)]
+
+    :param data: Datagram from the publisher
+    :return: List of quotes as (microseconds since the epoch, currency 1,
+             currency 2, price) tuples
+    """
+    view = memoryview(data)
+    view = view[:len(view) - len(view) % QUOTE_SIZE]
+    return [(micros, *intern_cross(cross), price)
+            for (micros, cross), (price,)
+            in zip(TIMESTAMP_AND_CROSS.iter_unpack(view),
+                   PRICE.iter_unpack(view))]
+
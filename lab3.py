@@ -5,25 +5,68 @@ This is free and unencumbered software released into the public domain.
 :Version: Fall2020
 """
 
+import argparse
+import atexit
+import multiprocessing
+import queue
+import selectors
 import socket
-from datetime import datetime
+import threading
+import time
 
+import capture
+import clock
+import event_sink
 import fxp_bytes_subscriber
+import metrics
+import quote_table
+import receiver
+import sequence
+from active_cycles import ActiveCycles
 import bellman_ford
+import compact_bellman_ford
+import dense_bellman_ford
+import parallel_search
 
+PUBLISHER_ADDRESS = ('127.0.0.1', 50403)
 
-def display_quote(message):
+# Graph classes that can run the arbitrage search, selected by name
+ENGINES = {
+    'dict': bellman_ford.BellmanFord,
+    'compact': compact_bellman_ford.CompactBellmanFord,
+    'dense': dense_bellman_ford.DenseBellmanFord,
+}
+
+
+def venue_currency(currency, venue):
+    """
+    Names the vertex of a currency as traded on a venue
+
+    >>> venue_currency('USD', 'A'), venue_currency('USD', None)
+    ('USD@A', 'USD')
+
+    :param currency: Currency code
+    :param venue: Name of the venue, None when there is only one feed
+    :return: Currency code qualified with the venue name
     """
-    Takes in a quote as a list and parses it into a string
-    :param message: list form of quote
-    :return: quote as a string
+    if venue is None:
+        return currency
+    return currency + '@' + venue
+
+
+def parse_venue(text):
+    """
+    Parses a venue given on the command line
+
+    >>> parse_venue('A=127.0.0.1:50403')
+    ('A', ('127.0.0.1', 50403))
+
+    :param text: Venue as NAME=HOST:PORT
+    :return: Tuple of the name and the publisher address
     """
-    message_string = ''
-    message_string += str(message[0]) + ' '
-    message_string += message[1] + ' '
-    message_string += message[2] + ' '
-    message_string += str(message[3])
-    return message_string
+    name, address = text.split('=', 1)
+    host, port = address.rsplit(':', 1)
+    return name, (host, int(port))
 
 
 class Lab3(object):
@@ -36,31 +79,186 @@ class Lab3(object):
     money than you started with.) If an arbitrage opportunity presents itself,
     we report it, otherwise we continue to receive messages from the publisher.
     """
-    def __init__(self):
+    def __init__(self, engine='dict', stale_after=1.5, workers=0, top=0,
+                 max_length=4, capture_path=None, instrument=False,
+                 venues=None, fast=False, sink=None, rcvbuf=None,
+                 clock_source=None, overlap=False, table=None):
         """
         Constructs a lab 3 object
+        :param engine: Name of the graph class in ENGINES to search with,
+                       'compact' keeping the graph in flat arrays and 'dense'
+                       being the NumPy one for many currencies
+        :param stale_after: Seconds after which a quote is removed as stale
+        :param workers: If not 0, search from every vertex on this many
+                        worker processes and report every distinct arbitrage
+        :param top: If not 0, report up to this many distinct arbitrage
+                    cycles, the most profitable first
+        :param max_length: Most conversions in a cycle reported with top
+        :param capture_path: If given, every datagram received is appended to
+                             this capture file (see capture.py)
+        :param instrument: Record per-stage latencies and counters, dumped
+                           at exit or on SIGUSR1 (see metrics.py)
+        :param venues: Dictionary of publisher address by venue name, to
+                       subscribe to several feeds on a socket each and merge
+                       them into one graph. Just PUBLISHER_ADDRESS if not
+                       given.
+        :param fast: Check the triangles and quadrilaterals through the
+                     crosses just quoted first, and only run the general
+                     search when none of them is an arbitrage
+        :param sink: Where quotes, stale removals and arbitrage are written
+                     (see event_sink.py), printed as they happen if not given
+        :param rcvbuf: Bytes of kernel receive buffer to ask for on each
+                       socket, so bursts queue up rather than being dropped
+                       while an analysis runs
+        :param clock_source: Clock for stale quotes, captures and how long
+                             cycles last (see clock.py), the system clock if
+                             not given
+        :param overlap: Add quotes to a graph that publishes versions (see
+                        BellmanFord.publish) and search the latest one on a
+                        thread of its own, so receiving carries on during a
+                        search. Needs an engine with versions, which the
+                        compact one has not.
+        :param table: quote_table.QuoteTable to write the quotes accepted to
+                      instead of searching them here, for analyzer processes
+                      (see run_analyzer) to search. An analyzer itself is
+                      given no venues.
         """
-        self.listener, self.address = self.start()
-        self.most_recent = datetime(1970, 1, 1)
-        self.sub_time = datetime.utcnow()
-        self.g = bellman_ford.BellmanFord()
+        if overlap and not ENGINES[engine].versioned:
+            raise ValueError('overlap needs an engine with versions, such as '
+                             'dict or dense')
+        if overlap and table is not None:
+            raise ValueError('overlap and a quote table cannot be combined')
+        if venues is None:
+            venues = {None: PUBLISHER_ADDRESS}
+        for venue in venues:
+            # Currency codes are 3 letters on the wire
+            name = venue_currency('XXX', venue).encode('utf-8')
+            if table is not None and len(name) > quote_table.NAME_SIZE:
+                raise ValueError('venue name {} is too long for the quote '
+                                 'table'.format(venue))
+        self.venues = venues
+        # Venue other venues transfer through
+        self.hub = next(iter(venues), None)
+        self.listeners = {}  # (socket, address) by venue
+        self.receivers = {}  # receiver.BatchReceiver by venue
+        self.selector = selectors.DefaultSelector()
+        for venue in venues:
+            listener, address = self.start()
+            self.listeners[venue] = listener, address
+            self.receivers[venue] = receiver.BatchReceiver(listener,
+                                                           rcvbuf=rcvbuf)
+            self.selector.register(listener, selectors.EVENT_READ, venue)
+        self.drops = {venue: 0 for venue in venues}  # Kernel drops seen
+        self.drops_checked = time.monotonic()
+        self.listener, self.address = self.listeners.get(self.hub,
+                                                         (None, None))
+        # Sequence is only meaningful within a cross of a feed, so each venue
+        # keeps the latest timestamp of each of its crosses
+        self.sequence = {venue: sequence.SequenceFilter() for venue in venues}
+        self.clock = clock_source or clock.SYSTEM
+        self.sub_time = self.clock.now()
+        self.g = ENGINES[engine](stale_after, clock_source=self.clock)
+        self.store = self.g  # Graph quotes are added to
+        self.overlap = overlap
+        if overlap:
+            self.store = bellman_ford.BellmanFord(stale_after,
+                                                  clock_source=self.clock)
+        self.latest = None  # (version, metrics start, newest) to search
+        self.published = threading.Event()
+        self.table = table
+        self.table_refused = None  # Why the table last refused a write
+        self.newest = 0  # Timestamp of the newest quote added
+        self.top = top
+        self.max_length = max_length
+        self.fast = fast
+        self.updated = set()  # Crosses added since the last search
+        self.removed = set()  # Crosses gone stale since the last search
+        self.cycles = ActiveCycles()
+        self.found = False  # Whether the last search found arbitrage
+        # Queue to pass the cycles found on to the analyzer that reports
+        # them, instead of reporting them here (see run_analyzer)
+        self.report_to = None
+        self.search = None
+        if workers:
+            self.search = parallel_search.ParallelSearch(workers)
+        self.capture = None
+        if capture_path:
+            self.capture = capture.CaptureWriter(capture_path, self.clock)
+            atexit.register(self.capture.close)
+        self.sink = sink or event_sink.PrintSink()
+        atexit.register(self.sink.close)
+        self.metrics = metrics.NullMetrics()
+        if instrument:
+            self.metrics = metrics.Metrics()
+            self.metrics.install()
 
     def run(self):
         """
         Loops to run program while connected to publisher
         :return: None
         """
+        self.subscribe()
+        if self.overlap:
+            threading.Thread(target=self.search_versions, daemon=True).start()
+        while True:
+            self.poll()
 
-        # Serialize address before sending to publisher
-        byte_stream = fxp_bytes_subscriber.serialize_address(self.address[0],
-                                                             self.address[1])
-        self.listener.sendto(byte_stream, ('127.0.0.1', 50403))
+    def subscribe(self):
+        """
+        Subscribes to the publisher of every venue
+        :return: None
+        """
+        for venue, (listener, address) in self.listeners.items():
+            # Serialize address before sending to publisher
+            byte_stream = fxp_bytes_subscriber.serialize_address(address[0],
+                                                                 address[1])
+            listener.sendto(byte_stream, self.venues[venue])
 
-        while True:
-            self.g.remove_stale_quotes()
-            data = self.listener.recv(4096)
-            self.iterate_through_data(data)
-            self.run_bellman()
+    def poll(self, timeout=None):
+        """
+        Waits for datagrams on any venue's socket, drains everything queued
+        on the ones that are ready, adds all their quotes and then searches
+        for arbitrage once, or with overlap publishes a version to search
+        :param timeout: Seconds to wait for a datagram, forever if None
+        :return: Number of datagrams received
+        """
+        self.remove_stale_quotes()
+        events = self.selector.select(timeout)
+        received = 0
+        for key, mask in events:
+            start = self.metrics.start()
+            datagrams = self.receivers[key.data].drain()
+            self.metrics.stop('receive', start)
+            received += len(datagrams)
+            for data in datagrams:
+                if self.capture is not None:
+                    self.capture.write(data)
+                self.iterate_through_data(data, key.data)
+        self.metrics.count('datagrams', received)
+        if received and self.table is None:
+            if self.overlap:
+                self.publish()
+            else:
+                self.run_bellman()
+        if time.monotonic() - self.drops_checked >= 1.0:
+            self.check_drops()
+        return received
+
+    def check_drops(self):
+        """
+        Reports datagrams the kernel dropped on any venue's socket since the
+        last check
+        :return: None
+        """
+        self.drops_checked = time.monotonic()
+        for venue, venue_receiver in self.receivers.items():
+            drops = venue_receiver.drops()
+            if drops is not None and drops > self.drops[venue]:
+                self.metrics.count('kernel_drops', drops - self.drops[venue])
+                self.sink.emit('log', 'kernel dropped {} datagrams{}'.format(
+                    drops - self.drops[venue],
+                    '' if venue is None else ' from ' + venue))
+                self.drops[venue] = drops
 
     @staticmethod
     def start():
@@ -72,55 +270,347 @@ class Lab3(object):
         listener.bind(('localhost', 0))
         return listener, listener.getsockname()
 
-    def iterate_through_data(self, data):
+    def iterate_through_data(self, data, venue=None):
         """
         Iterates through the received quote, unmarshalling, printing and
         adding the quote to the graph as appropriate
         Ignores quotes that are sent out of sequence
         :param data: Quote directly from publisher
+        :param venue: Name of the venue the quote came from
+        :return: None
+        """
+        # Can be more than 1 quote per message, and they are all decoded in
+        # one go
+        start = self.metrics.start()
+        quotes = fxp_bytes_subscriber.unmarshal_messages(data)
+        self.metrics.stop('unmarshal_message', start)
+        self.add_quotes(quotes, venue)
+
+    def add_quotes(self, quotes, venue=None):
+        """
+        Prints and adds decoded quotes to the graph, ignoring quotes that are
+        no newer than the last one accepted for their cross. When a cross is
+        quoted more than once only the last quote is added, so the graph is
+        updated once per cross.
+
+        With several venues, each venue's currencies are separate vertices,
+        so its quotes are separate edges, and every currency is linked to the
+        same currency on the first venue at a rate of 1. Those links are
+        refreshed with the venue's quotes, and go stale with them, so a cycle
+        through them is an arbitrage across venues. Here the same cross is
+        quoted on two venues with a spread, which opens a cycle through the
+        links, and it closes when the spread does:
+
+        >>> manual = clock.ManualClock(clock.seconds_to_micros(100))
+        >>> sink = event_sink.CountingSink()
+        >>> l = Lab3(venues={'A': None, 'B': None}, sink=sink,
+        ...          clock_source=manual)
+        >>> l.add_quotes([(manual.now(), 'GBP', 'USD', 1.25)], 'A')
+        >>> l.add_quotes([(manual.now(), 'GBP', 'USD', 1.27)], 'B')
+        >>> l.run_bellman()
+        >>> list(l.cycles.active)
+        [('GBP@A', 'GBP@B', 'USD@B', 'USD@A', 'GBP@A')]
+        >>> manual.advance(1000)
+        >>> l.add_quotes([(manual.now(), 'GBP', 'USD', 1.25)], 'B')
+        >>> l.run_bellman()
+        >>> list(l.cycles.active), sink.counts['arbitrage'], \
+            sink.counts['closed']
+        ([], 1, 1)
+
+        :param quotes: Iterable of decoded quotes, in the order received
+        :param venue: Name of the venue the quotes came from
         :return: None
         """
-        # Can be more than 1 quote per message, and each quote is 32 bytes
-        # So need to find out how many iterations you need to decode
-        iterations = len(data) / 32
-        for i in range(int(iterations)):
-            message = fxp_bytes_subscriber.unmarshal_message(
-                data[i * 32:(i + 1) * 32])
-            print(display_quote(message))
-            if message[0] >= self.most_recent:
-                self.most_recent = message[0]
-                self.g.add_to_graph(message)
+        latest = {}
+        received = ignored = 0
+        emit = self.sink.emit
+        accept = self.sequence[venue].accept
+        advance = self.sequence[venue].advance
+        transfer = venue != self.hub
+        for micros, c1, c2, price in quotes:
+            message = [micros, venue_currency(c1, venue),
+                       venue_currency(c2, venue), price]
+            emit('quote', micros, message[1], message[2], price)
+            received += 1
+            if accept(micros, c1, c2):
+                # Either way round, a cross is one pair of edges
+                cross = (message[1], message[2])
+                latest[cross if cross[0] < cross[1] else cross[::-1]] = message
+                if transfer:
+                    for currency in (c1, c2):
+                        link = (venue_currency(currency, venue),
+                                venue_currency(currency, self.hub))
+                        # A late quote must not make the link look older
+                        if advance(micros, *link):
+                            latest[link] = [message[0], link[0], link[1],
+                                            1.0]
             else:
-                print('ignoring out-of-sequence message')
+                emit('ignored')
+                ignored += 1
+
+        self.add_latest(latest)
+        self.metrics.count('quotes', received)
+        self.metrics.count('out_of_sequence', ignored)
 
-    def run_bellman(self):
+    def add_latest(self, latest):
         """
-        Runs the Bellman-Ford algorithm from each vertex until a negative
-        cycle is found or all vertices have been cycled through
+        Adds the latest quote of each cross to the graph, or writes them to
+        the quote table if there is one
+        :param latest: Dictionary of quote in list format by cross
         :return: None
         """
-        vertices = self.g.get_vertices()
+        start = self.metrics.start()
+        if self.table is not None:
+            if latest:
+                try:
+                    self.table.write(latest.values())
+                except ValueError as e:
+                    # The batch is refused as a whole, and receiving goes on
+                    self.metrics.count('table_refused', len(latest))
+                    if str(e) != self.table_refused:
+                        self.table_refused = str(e)
+                        self.sink.emit('log', 'quote table refused quotes: '
+                                       + self.table_refused)
+            self.metrics.stop('table_write', start)
+            return
+        newest = self.newest
+        for message in latest.values():
+            self.store.add_to_graph(message)
+            if message[0] > newest:
+                newest = message[0]
+        self.newest = newest
+        self.updated.update(latest)
+        self.metrics.stop('add_to_graph', start)
 
-        # Runs Bellman-Ford starting from every vertex in the graph looking for
-        # an arbitrage opportunity
-        # If one is found and a cycle is returned, we print it and stop
-        for key in vertices:
-            dist, prev, neg_edge, cycle = self.g.shortest_paths(key)
+    def analyze_table(self, table, interval=0.0005, seconds=None,
+                      claimed=None, found=None):
+        """
+        Searches the quotes another process writes to a quote table, as an
+        analyzer process. Whatever changed since the last look is added to
+        the graph and searched once, as a drained socket is in poll.
 
-            if len(cycle) > 0:
-                cycle.reverse()
-                self.print_arbitrage(cycle)
-                break
+        Several analyzers take turns instead of all searching the same
+        quotes: each keeps its graph up to date, but a state of the table is
+        only searched by the analyzer that claims it first, so one can search
+        while another is still busy with an older state. Only one analyzer
+        reports, the others pass what they find on to it (see report_to).
+        :param table: quote_table.QuoteTable attached to
+        :param interval: Seconds to wait for when nothing changed
+        :param seconds: Seconds to run for, for ever if not given
+        :param claimed: With several analyzers, multiprocessing.Value they
+                        share holding the sequence number of the newest
+                        table state claimed for a search
+        :param found: With several analyzers, the multiprocessing queue the
+                      cycles found are passed on through
+        :return: None
+        """
+        stop = None if seconds is None else time.monotonic() + seconds
+        while stop is None or time.monotonic() < stop:
+            self.remove_stale_quotes()
+            start = self.metrics.start()
+            quotes = table.changes()
+            if quotes:
+                self.metrics.stop('table_read', start)
+                self.metrics.count('quotes', len(quotes))
+                self.add_latest({(c1, c2): [micros, c1, c2, price]
+                                 for micros, c1, c2, price in quotes})
+            if found is not None and self.report_to is None:
+                self.report_found(found)
+
+            if claimed is None:
+                search = bool(quotes)
+            else:
+                with claimed.get_lock():
+                    search = claimed.value < table.sequence
+                    if search:
+                        claimed.value = table.sequence
+            # The reporting analyzer also re-verifies its open cycles when
+            # another has the search
+            if search or (quotes and self.report_to is None):
+                self.run_bellman(search=search)
+            if not quotes:
+                time.sleep(interval)
+
+    def report_found(self, found):
+        """
+        Reports the cycles other analyzers found that still hold in this
+        graph, which has read at least as far into the quote table as theirs
+        had
+        :param found: multiprocessing queue of (cycles, timestamp of the
+                      newest quote searched) from the other analyzers
+        :return: None
+        """
+        while True:
+            try:
+                cycles, newest = found.get_nowait()
+            except queue.Empty:
+                return
+            self.report_cycles([cycle for cycle in cycles
+                                if self.cycles.holds(self.g, cycle)],
+                               self.clock.now(), newest=newest)
+
+    def remove_stale_quotes(self):
+        """
+        Removes stale quotes from the graph, reporting each one removed
+        :return: None
+        """
+        start = self.metrics.start()
+        removed = self.store.remove_stale_quotes()
+        self.metrics.stop('remove_stale_quotes', start)
+        self.metrics.count('stale_removed', len(removed))
+        self.removed.update(removed)
+        for cross in removed:
+            self.sink.emit('stale', cross)
+
+    def publish(self):
+        """
+        Publishes the graph quotes have been added to as a new version, and
+        wakes up the search thread. Only the latest version is searched, so
+        ones published while a search runs are skipped.
+        :return: None
+        """
+        self.latest = self.store.publish(), self.metrics.start(), self.newest
+        self.updated = set()
+        self.removed = set()
+        self.published.set()
 
-    def print_arbitrage(self, arbitrage_path):
+    def search_versions(self):
         """
-        Takes in the arbitrage path and prints the result.
-        Does the calculation of conversions along the way
+        Searches each latest version as it is published, for ever. Run on
+        its own thread with overlap.
+        :return: None
+        """
+        searched = 0
+        while True:
+            self.published.wait()
+            self.published.clear()
+            version, start, newest = self.latest
+            self.metrics.count('versions_skipped',
+                               version.number - searched - 1)
+            searched = version.number
+            self.run_bellman(version, newest)
+            # From the quotes being published to their search being done
+            self.metrics.stop('version_lag', start)
+
+    def run_bellman(self, version=None, newest=None, search=True):
+        """
+        Searches the graph for arbitrage, reporting each cycle when it opens
+        and again when it closes. The open cycles through the crosses that
+        were requoted or went stale are re-verified first, and a cycle found
+        again while still open is not reported again. The search is skipped
+        when the edge changes since the last search could not have made a new
+        cycle (see BellmanFord.search_needed), which while cycles are open
+        relies on distances settled around them after each search that finds
+        any (see BellmanFord.settle_around).
+        :param version: With overlap, the GraphVersion to search, whose
+                        changes since the version searched before stand in
+                        for the crosses requoted and gone stale
+        :param newest: With overlap, the timestamp of the newest quote in
+                       the version
+        :param search: Whether to search at all, or only re-verify the open
+                       cycles while another analyzer searches
+        :return: None
+        """
+        now = self.clock.now()
+        start = self.metrics.start()
+        if version is None:
+            updated, self.updated = self.updated, set()
+            crosses = updated | self.removed
+            self.removed = set()
+        else:
+            updated = crosses = self.g.adopt(version)
+        closed = self.cycles.verify(self.g, crosses, now)
+        cycles = []
+        if search:
+            dirty = self.g.take_dirty()
+            if not self.g.search_needed(dirty, self.found):
+                self.metrics.count('searches_skipped')
+            else:
+                cycles = self.find_cycles(updated)
+                self.found = bool(cycles)
+                self.metrics.count('searches_run')
+                if cycles:
+                    # Lets the search be skipped while they stay open, and
+                    # any other cycle settling runs into is reported too
+                    others = self.g.settle_around(
+                        list(self.cycles.active) + cycles)
+                    cycles += others or []
+            self.metrics.stop('shortest_paths', start)
+
+        for cycle, lifetime in closed:
+            self.sink.emit('closed', cycle, lifetime)
+        self.metrics.count('cycles_closed', len(closed))
+        if newest is None:
+            newest = self.newest
+        if self.report_to is not None:
+            if cycles:
+                self.report_to.put((cycles, newest))
+            return
+        self.report_cycles(cycles, now, version, newest)
+
+    def report_cycles(self, cycles, now, version=None, newest=None):
+        """
+        Reports the cycles found that were not open yet
+        :param cycles: List of cycles, each a list of vertices in order
+                       ending with the first one
+        :param now: Time they were found, in microseconds since the epoch
+        :param version: GraphVersion they were found in, if any
+        :param newest: Timestamp of the newest quote searched
+        :return: None
+        """
+        opened = 0
+        for cycle in cycles:
+            if self.cycles.open(cycle, now):
+                opened += 1
+                self.print_arbitrage(cycle, version)
+        if opened:
+            self.metrics.count('cycles', opened)
+            # From the newest quote being published to its arbitrage being
+            # reported
+            self.metrics.record('quote_to_report',
+                                (self.clock.now() - newest) * 1000)
+
+    def find_cycles(self, updated):
+        """
+        Looks for a negative cycle over the whole graph, only repairing the
+        distances of the previous run around the quotes that changed. With
+        worker processes, every distinct cycle found from any vertex is
+        returned instead, and with top the most profitable cycles in order.
+        When fast is set, short cycles through the crosses just quoted are
+        looked for first and returned if there are any.
+        :param updated: Crosses quoted since the last search
+        :return: List of cycles, each a list of vertices in order ending with
+                 the first one
+        """
+        if self.fast:
+            start = self.metrics.start()
+            short = self.g.find_short_cycles(updated)
+            self.metrics.stop('short_cycles', start)
+            if short:
+                return [cycle for gross, cycle in short]
+        if self.search is not None:
+            return self.search.find_cycles(self.g)
+        if self.top:
+            return [cycle for gross, cycle in self.g.find_arbitrage_cycles(
+                self.top, self.max_length)]
+
+        dist, prev, neg_edge, cycle = self.g.find_negative_cycle(
+            incremental=True)
+
+        if len(cycle) > 0:
+            cycle.reverse()
+            return [cycle]
+        return []
+
+    def print_arbitrage(self, arbitrage_path, version=None):
+        """
+        Takes in the arbitrage path and reports it with the rate of each
+        conversion along the way, which the sink works out the result from
         :param arbitrage_path: List of vertices in the arbitrage opportunity
+        :param version: GraphVersion the arbitrage was found in, reported
+                        with it, if any
         """
-        value = 100
-        print('ARBITRAGE:')
-        print('\t start with', arbitrage_path[0], '100')
+        rates = []
         for i in range(len(arbitrage_path) - 1):
             exchange_rate = self.g.get_exchange_rate(
                 arbitrage_path[i], arbitrage_path[i+1])
@@ -130,9 +620,80 @@ class Lab3(object):
             else:
                 exchange_rate = 1 / abs(exchange_rate)
 
-            value *= exchange_rate
-            print('\t', arbitrage_path[i], 'for', arbitrage_path[i + 1],
-                  'at', exchange_rate, '-->', arbitrage_path[i + 1], value)
+            rates.append(exchange_rate)
+        if version is None:
+            self.sink.emit('arbitrage', list(arbitrage_path), rates)
+        else:
+            self.sink.emit('arbitrage', list(arbitrage_path), rates,
+                           version.number, version.time)
+
+
+def run_analyzer(table_name, output='text', capacity=65536, seconds=None,
+                 results=None, claimed=None, found=None, reporting=True,
+                 **options):
+    """
+    Body of an analyzer process, searching the quote table that a Lab3
+    given the table writes to until the process that started it is gone
+    :param table_name: Name of the quote table's shared memory
+    :param output: Output format, as in event_sink.make_sink
+    :param capacity: Events buffered for output, as in event_sink.make_sink
+    :param seconds: Seconds to run for, for ever if not given
+    :param results: multiprocessing queue to put the analyzer's
+                    metrics.Metrics on when done, if any
+    :param claimed: Shared with the other analyzers, as in analyze_table
+    :param found: Shared with the other analyzers, as in analyze_table
+    :param reporting: Whether this analyzer reports, rather than passing
+                      the cycles it finds on through found
+    :param options: Keyword arguments for Lab3, without venues or sink
+    :return: None
+    """
+    table = quote_table.QuoteTable(table_name)
+    sink = event_sink.NullSink()
+    if reporting:
+        sink = event_sink.make_sink(output, capacity)
+    analyzer = Lab3(venues={}, sink=sink, **options)
+    if not reporting:
+        analyzer.report_to = found
+    if results is not None:
+        analyzer.metrics = metrics.Metrics()
+    parent = multiprocessing.parent_process()
+    stop = None if seconds is None else time.monotonic() + seconds
+    try:
+        while parent is None or parent.is_alive():
+            left = 1.0 if stop is None else stop - time.monotonic()
+            if left <= 0:
+                break
+            analyzer.analyze_table(table, seconds=min(left, 1.0),
+                                   claimed=claimed, found=found)
+    except KeyboardInterrupt:
+        pass  # ^C reaches the whole process group; the parent reports it
+    finally:
+        analyzer.sink.close()
+        table.close()
+    if results is not None:
+        results.put(analyzer.metrics)
+
+
+def start_analyzers(table, count, **kwargs):
+    """
+    Starts analyzer processes on a quote table. With more than one, they take
+    turns searching and the first one reports (see Lab3.analyze_table).
+    :param table: quote_table.QuoteTable written by this process
+    :param count: Number of analyzer processes
+    :param kwargs: Keyword arguments for run_analyzer
+    :return: List of the processes
+    """
+    if count > 1:
+        kwargs.update(claimed=multiprocessing.Value('Q', 0),
+                      found=multiprocessing.Queue())
+    processes = [multiprocessing.Process(target=run_analyzer,
+                                         args=(table.name,),
+                                         kwargs=dict(kwargs, reporting=i == 0),
+                                         daemon=True)
+                 for i in range(count)]
+    for process in processes:
+        process.start()
+    return processes
 
 
 if __name__ == '__main__':
@@ -140,5 +701,57 @@ if __name__ == '__main__':
     Main entry point into the program
     Creates a Lab3 object and runs
     """
-    lab3 = Lab3()
+    parser = argparse.ArgumentParser(description='Forex arbitrage subscriber')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='dict')
+    parser.add_argument('--stale-after', type=float, default=1.5,
+                        help='seconds after which a quote is stale')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='worker processes to search every vertex on')
+    parser.add_argument('--top', type=int, default=0,
+                        help='report up to this many arbitrage cycles, '
+                             'the most profitable first')
+    parser.add_argument('--max-length', type=int, default=4,
+                        help='most conversions in a cycle reported with --top')
+    parser.add_argument('--capture', help='file to append datagrams to')
+    parser.add_argument('--metrics', action='store_true',
+                        help='record stage latencies, dumped at exit or on '
+                             'SIGUSR1')
+    parser.add_argument('--venue', action='append', type=parse_venue,
+                        help='subscribe to the publisher of a venue, given '
+                             'as NAME=HOST:PORT, repeated for each venue')
+    parser.add_argument('--fast', action='store_true',
+                        help='check 3 and 4-way cycles through each new '
+                             'quote before the general search')
+    parser.add_argument('--output', choices=sorted(event_sink.FORMATS),
+                        default='text', help='format of the output')
+    parser.add_argument('--buffer', type=int, default=65536,
+                        help='events buffered for the output thread, 0 to '
+                             'print synchronously')
+    parser.add_argument('--rcvbuf', type=int,
+                        help='bytes of kernel receive buffer per socket')
+    parser.add_argument('--overlap', action='store_true',
+                        help='search published versions of the graph on a '
+                             'thread of its own while quotes keep arriving')
+    parser.add_argument('--analyzers', type=int, default=0,
+                        help='only receive here, and search in this many '
+                             'processes reading a shared memory quote table')
+    parser.add_argument('--table-size', type=int,
+                        help='most crosses the quote table of --analyzers '
+                             'holds, 1024 for each venue if not given')
+    args = parser.parse_args()
+    table = None
+    if args.analyzers:
+        table = quote_table.QuoteTable(
+            capacity=args.table_size or 1024 * len(args.venue or [None]))
+        atexit.register(table.close)
+        start_analyzers(table, args.analyzers, output=args.output,
+                        capacity=args.buffer, engine=args.engine,
+                        stale_after=args.stale_after, workers=args.workers,
+                        top=args.top, max_length=args.max_length,
+                        instrument=args.metrics, fast=args.fast)
+    lab3 = Lab3(args.engine, args.stale_after, args.workers, args.top,
+                args.max_length, args.capture, args.metrics,
+                dict(args.venue) if args.venue else None, args.fast,
+                event_sink.make_sink(args.output, args.buffer), args.rcvbuf,
+                overlap=args.overlap, table=table)
     lab3.run()
@@ -0,0 +1,214 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import event_sink
+import fxp_bytes_subscriber
+import metrics
+from lab3 import ENGINES, Lab3, parse_venue
+
+
+class QuoteProtocol(asyncio.DatagramProtocol):
+    """
+    Receiving stage of AsyncLab3. Every datagram is decoded as soon as it
+    arrives and its quotes are put on a bounded queue for the analysis stage.
+    If analysis falls so far behind that the queue is full, the oldest
+    datagram is dropped to make room, as only the latest state matters.
+    """
+    def __init__(self, queue, capture=None, stage_metrics=None, venue=None):
+        """
+        Constructs the protocol
+        :param queue: asyncio.Queue the decoded quotes are put on, tagged
+                      with their venue
+        :param capture: capture.CaptureWriter to record datagrams to, if any
+        :param stage_metrics: metrics.Metrics to time decoding with, if any
+        :param venue: Name of the venue this protocol receives from
+        """
+        self.queue = queue
+        self.venue = venue
+        self.capture = capture
+        self.metrics = stage_metrics or metrics.NullMetrics()
+        self.dropped = 0  # Datagrams dropped because the queue was full
+
+    def datagram_received(self, data, addr):
+        """
+        Decodes a datagram and queues its quotes
+        :param data: Datagram from the publisher
+        :param addr: Address of the publisher
+        :return: None
+        """
+        if self.capture is not None:
+            self.capture.write(data)
+        start = self.metrics.start()
+        quotes = fxp_bytes_subscriber.unmarshal_messages(data)
+        self.metrics.stop('unmarshal_message', start)
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.metrics.count('queue_dropped')
+        self.queue.put_nowait((self.venue, quotes))
+
+
+class AsyncLab3(Lab3):
+    """
+    Version of Lab3 running on asyncio, where receiving and decoding
+    datagrams is decoupled from analysing them. The event loop only receives
+    and decodes, while the graph is updated and searched on a thread of its
+    own, so the sockets keep being drained during a search. Each analysis
+    takes everything that arrived while the last one ran, adds it to the
+    graph as a single update and runs detection once, so a burst of
+    datagrams is analysed a few times in its latest state rather than once
+    per datagram.
+    """
+    def __init__(self, engine='dict', stale_after=1.5, workers=0, top=0,
+                 max_length=4, capture_path=None, instrument=False,
+                 venues=None, fast=False, sink=None, rcvbuf=None,
+                 clock_source=None, queue_size=1024):
+        """
+        Constructs an AsyncLab3 object
+        :param engine: Name of the graph class in lab3.ENGINES to search with
+        :param stale_after: Seconds after which a quote is removed as stale
+        :param workers: Worker processes to search every vertex on, as in Lab3
+        :param top: Number of cycles to report, as in Lab3
+        :param max_length: Most conversions in a reported cycle, as in Lab3
+        :param capture_path: File to append datagrams to, as in Lab3
+        :param instrument: Record stage latencies, as in Lab3
+        :param venues: Publisher address by venue name, as in Lab3
+        :param fast: Check short cycles through new quotes first, as in Lab3
+        :param sink: Where the output is written, as in Lab3
+        :param rcvbuf: Bytes of kernel receive buffer per socket, as in Lab3
+        :param clock_source: Clock to judge stale quotes by, as in Lab3
+        :param queue_size: Number of datagrams that can wait for analysis
+        """
+        super().__init__(engine, stale_after, workers, top, max_length,
+                         capture_path, instrument, venues, fast, sink,
+                         rcvbuf, clock_source)
+        self.stale_after = stale_after
+        self.queue_size = queue_size
+
+    def run(self):
+        """
+        Runs the program while connected to the publisher
+        :return: None
+        """
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """
+        Subscribes to the publisher and analyses quotes as they arrive
+        :return: None
+        """
+        queue = asyncio.Queue(self.queue_size)
+        loop = asyncio.get_running_loop()
+        # The sockets are handed over to the event loop
+        self.selector.close()
+        transports = []
+        for venue, (listener, address) in self.listeners.items():
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda venue=venue: QuoteProtocol(queue, self.capture,
+                                                  self.metrics, venue),
+                sock=listener)
+            transports.append(transport)
+        self.subscribe()
+
+        try:
+            await self.analyze(queue)
+        finally:
+            for transport in transports:
+                transport.close()
+
+    async def analyze(self, queue):
+        """
+        Analysis stage, which waits for quotes and then hands everything
+        queued to the analysis thread in one go. Only that thread touches
+        the graph, and the event loop keeps receiving while it works.
+        :param queue: asyncio.Queue of (venue, decoded quotes) from
+                      QuoteProtocol
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(1, 'analysis') as analysis:
+            while True:
+                try:
+                    batches = [await asyncio.wait_for(queue.get(),
+                                                      self.stale_after)]
+                except asyncio.TimeoutError:
+                    # Nothing arrived, but quotes still go stale. Removing
+                    # quotes cannot create an arbitrage, so no need to
+                    # search.
+                    await loop.run_in_executor(analysis,
+                                               self.remove_stale_quotes)
+                    continue
+                while not queue.empty():
+                    batches.append(queue.get_nowait())
+                await loop.run_in_executor(analysis, self.analyze_batches,
+                                           batches)
+
+    def analyze_batches(self, batches):
+        """
+        Adds the quotes of a run of datagrams to the graph and searches it
+        once, on the analysis thread
+        :param batches: List of (venue, decoded quotes) in arrival order
+        :return: None
+        """
+        by_venue = {}
+        for venue, quotes in batches:
+            by_venue.setdefault(venue, []).append(quotes)
+
+        self.remove_stale_quotes()
+        for venue, venue_batches in by_venue.items():
+            self.add_quotes(chain.from_iterable(venue_batches), venue)
+        self.run_bellman()
+        if time.monotonic() - self.drops_checked >= 1.0:
+            self.check_drops()
+
+if __name__ == '__main__':
+    """
+    Main entry point into the program
+    Creates an AsyncLab3 object and runs
+    """
+    parser = argparse.ArgumentParser(
+        description='Forex arbitrage subscriber on asyncio')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='dict')
+    parser.add_argument('--stale-after', type=float, default=1.5,
+                        help='seconds after which a quote is stale')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='worker processes to search every vertex on')
+    parser.add_argument('--top', type=int, default=0,
+                        help='report up to this many arbitrage cycles, '
+                             'the most profitable first')
+    parser.add_argument('--max-length', type=int, default=4,
+                        help='most conversions in a cycle reported with --top')
+    parser.add_argument('--capture', help='file to append datagrams to')
+    parser.add_argument('--metrics', action='store_true',
+                        help='record stage latencies, dumped at exit or on '
+                             'SIGUSR1')
+    parser.add_argument('--venue', action='append', type=parse_venue,
+                        help='subscribe to the publisher of a venue, given '
+                             'as NAME=HOST:PORT, repeated for each venue')
+    parser.add_argument('--fast', action='store_true',
+                        help='check 3 and 4-way cycles through each new '
+                             'quote before the general search')
+    parser.add_argument('--output', choices=sorted(event_sink.FORMATS),
+                        default='text', help='format of the output')
+    parser.add_argument('--buffer', type=int, default=65536,
+                        help='events buffered for the output thread, 0 to '
+                             'print synchronously')
+    parser.add_argument('--rcvbuf', type=int,
+                        help='bytes of kernel receive buffer per socket')
+    args = parser.parse_args()
+    lab3 = AsyncLab3(args.engine, args.stale_after, args.workers, args.top,
+                     args.max_length, args.capture, args.metrics,
+                     dict(args.venue) if args.venue else None, args.fast,
+                     event_sink.make_sink(args.output, args.buffer),
+                     args.rcvbuf)
+    lab3.run()
@@ -0,0 +1,238 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+
+Low overhead latency histograms and counters for the subscriber's hot path.
+Latencies are recorded in nanoseconds into fixed log-linear buckets (eight
+per power of two, so about 12% resolution), the way HDR histograms do, so
+recording a sample only increments an array slot.
+"""
+import atexit
+import signal
+import sys
+import threading
+from array import array
+from time import perf_counter_ns
+
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+BUCKETS = 64 * SUB_BUCKETS
+
+
+def bucket_index(value):
+    """
+    Gets the bucket of a value. Values below 2 * SUB_BUCKETS get a bucket
+    each, larger ones share a bucket with values that have the same top
+    SUB_BUCKET_BITS + 1 bits.
+
+    >>> [bucket_index(v) for v in (0, 15, 16, 17, 18, 31, 32, 1000)]
+    [0, 15, 16, 16, 17, 23, 24, 63]
+
+    :param value: Non-negative integer
+    :return: Index of its bucket
+    """
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    if shift <= 0:
+        return value
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_value(index):
+    """
+    Gets the smallest value that falls in a bucket
+    :param index: Index of the bucket
+    :return: Smallest value in the bucket
+    """
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return (index - shift * SUB_BUCKETS) << shift
+
+
+class Histogram(object):
+    """
+    Fixed size histogram of non-negative integer samples
+    """
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * BUCKETS))
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        """
+        Records a sample. Negative samples, such as a latency across two
+        clocks that are slightly apart, are counted as 0.
+
+        >>> h = Histogram()
+        >>> h.record(-5)
+        >>> h.counts[0], h.counts[-1], h.max
+        (1, 0, 0)
+
+        :param value: Integer
+        :return: None
+        """
+        if value < 0:
+            value = 0
+        self.counts[min(bucket_index(value), BUCKETS - 1)] += 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+
+    def add(self, other):
+        """
+        Adds the samples of another histogram to this one
+        :param other: Histogram
+        :return: None
+        """
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        """
+        Gets the value below which the given fraction of samples fall, to the
+        resolution of the buckets
+        :param fraction: Fraction of the samples, 0.5 for the median
+        :return: Smallest value of the bucket holding that percentile
+        """
+        wanted = max(1, int(fraction * self.total + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return bucket_value(index)
+        return self.max
+
+
+class Metrics(object):
+    """
+    Per-stage latency histograms and named counters. A stage is timed with
+
+        start = metrics.start()
+        ...
+        metrics.stop('decode', start)
+
+    Recording, counting and dumping take a lock, as with overlap the search
+    thread records while quotes are added, and a dump on SIGUSR1 can come at
+    any time. It is reentrant since the signal handler runs on the main
+    thread, which may be holding it.
+    """
+    def __init__(self):
+        self.stages = {}  # Histogram of latencies in nanoseconds by stage
+        self.counters = {}
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        """
+        Leaves the lock out when pickled, as when an analyzer process sends
+        its metrics back
+        :return: Dictionary of the attributes to pickle
+        """
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores pickled metrics with a lock of their own
+        :param state: Result of __getstate__
+        :return: None
+        """
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def start(self):
+        """
+        Starts timing a stage
+        :return: Start time to pass to stop
+        """
+        return perf_counter_ns()
+
+    def stop(self, stage, start):
+        """
+        Records the latency of a stage
+        :param stage: Name of the stage
+        :param start: Result of start
+        :return: None
+        """
+        self.record(stage, perf_counter_ns() - start)
+
+    def record(self, stage, nanoseconds):
+        """
+        Records a latency measured some other way
+        :param stage: Name of the stage
+        :param nanoseconds: Latency in nanoseconds
+        :return: None
+        """
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.record(nanoseconds)
+
+    def count(self, name, n=1):
+        """
+        Adds to a counter
+        :param name: Name of the counter
+        :param n: Amount to add
+        :return: None
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def dump(self, file=None):
+        """
+        Prints the latency percentiles of each stage and the counters
+        :param file: File to print to, standard error if not given
+        :return: None
+        """
+        file = file or sys.stderr
+        lines = ['{:<20} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+            'stage (us)', 'count', 'p50', 'p90', 'p99', 'max')]
+        with self.lock:
+            for stage, histogram in self.stages.items():
+                lines.append(
+                    '{:<20} {:>9} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                        stage, histogram.total,
+                        *(histogram.percentile(fraction) / 1000
+                          for fraction in (0.5, 0.9, 0.99)),
+                        histogram.max / 1000))
+            for name, value in self.counters.items():
+                lines.append('{:<20} {:>9}'.format(name, value))
+        print('\n'.join(lines), file=file)
+
+    def install(self):
+        """
+        Dumps the metrics at exit, and on SIGUSR1 where there is one
+        :return: None
+        """
+        atexit.register(self.dump)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump())
+
+
+class NullMetrics(object):
+    """
+    Stand-in for Metrics when instrumentation is off, where every call does
+    nothing
+    """
+    def start(self):
+        return 0
+
+    def stop(self, stage, start):
+        pass
+
+    def record(self, stage, nanoseconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def dump(self, file=None):
+        pass
+
+    def install(self):
+        pass
@@ -0,0 +1,122 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+"""
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from bellman_ford import BellmanFord
+
+
+def snapshot(g):
+    """
+    Makes a compact, picklable copy of the edges of a graph: the currencies,
+    and parallel arrays of the source index, destination index and weight of
+    every edge
+    :param g: BellmanFord graph
+    :return: Tuple of (currencies, sources, destinations, weights)
+    """
+    currencies = tuple(g.get_vertices())
+    index = {currency: i for i, currency in enumerate(currencies)}
+    sources = array('H')
+    destinations = array('H')
+    weights = array('d')
+    for (c1, c2), weight in g.edges.items():
+        sources.append(index[c1])
+        destinations.append(index[c2])
+        weights.append(weight)
+    return currencies, sources, destinations, weights
+
+
+def from_snapshot(graph_snapshot):
+    """
+    Rebuilds a BellmanFord graph that can run shortest_paths from a snapshot
+    :param graph_snapshot: Result of snapshot
+    :return: BellmanFord graph
+    """
+    currencies, sources, destinations, weights = graph_snapshot
+    g = BellmanFord()
+    g.graph = {currency: {} for currency in currencies}
+    for i, j, weight in zip(sources, destinations, weights):
+        g.graph[currencies[i]][currencies[j]] = None
+        g.edges[(currencies[i], currencies[j])] = weight
+    return g
+
+
+def canonical_cycle(cycle):
+    """
+    Rotates a cycle so that it starts at its smallest vertex, so the same
+    cycle found from different vertices compares equal
+    :param cycle: Vertices of a cycle in order, ending with the first one
+    :return: Tuple of the rotated cycle, ending with the first vertex
+    """
+    body = cycle[:-1]
+    start = body.index(min(body))
+    body = body[start:] + body[:start]
+    return tuple(body + [body[0]])
+
+
+def search_shard(graph_snapshot, start_vertices, tolerance=0.0001):
+    """
+    Runs shortest_paths from each of the start vertices, collecting the
+    negative cycles found. Runs in the worker processes.
+    :param graph_snapshot: Result of snapshot
+    :param start_vertices: Vertices to run shortest_paths from
+    :param tolerance: Passed on to shortest_paths
+    :return: Set of canonical cycles
+    """
+    g = from_snapshot(graph_snapshot)
+    cycles = set()
+    for vertex in start_vertices:
+        cycle = g.shortest_paths(vertex, tolerance)[3]
+        if cycle:
+            cycle.reverse()
+            cycles.add(canonical_cycle(cycle))
+    return cycles
+
+
+class ParallelSearch(object):
+    """
+    Runs shortest_paths from every vertex of a graph to find every distinct
+    arbitrage it reports, spread over a pool of worker processes. The start
+    vertices are split into one shard per worker and the cycles found are
+    merged, with duplicates removed. The pool is created once and reused for
+    every search.
+    """
+    def __init__(self, workers):
+        """
+        Starts the worker processes
+        :param workers: Number of worker processes
+        """
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(workers)
+
+    def find_cycles(self, g, tolerance=0.0001):
+        """
+        Searches the graph from every vertex
+        :param g: BellmanFord graph
+        :param tolerance: Passed on to shortest_paths
+        :return: List of the distinct cycles found, each a list of vertices in
+                 order ending with the first one
+        """
+        vertices = list(g.get_vertices())
+        if not vertices:
+            return []
+        graph_snapshot = snapshot(g)
+        shards = [vertices[i::self.workers] for i in range(self.workers)]
+        futures = [self.pool.submit(search_shard, graph_snapshot, shard,
+                                    tolerance)
+                   for shard in shards if shard]
+        cycles = set()
+        for future in futures:
+            cycles.update(future.result())
+        return [list(cycle) for cycle in sorted(cycles)]
+
+    def shutdown(self):
+        """
+        Stops the worker processes
+        :return: None
+        """
+        self.pool.shutdown()
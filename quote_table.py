@@ -0,0 +1,199 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+
+Latest quote of every cross in shared memory, so one process can receive and
+decode the feed while others search it for arbitrage, without pickling
+anything per update. The table is a fixed layout:
+
+    header  8 bytes  sequence number, odd while a write is in progress
+            8 bytes  number of slots in use
+    slots   48 bytes each, one per cross in the order first quoted:
+            16 bytes currency 1 (UTF-8, zero padded)
+            16 bytes currency 2 (UTF-8, zero padded)
+            8 bytes  timestamp, microseconds since the epoch
+            8 bytes  price
+
+A cross has one slot either way round, holding the currencies in the order of
+its latest quote. Names longer than 16 bytes, such as long venue names, are
+refused rather than cut short.
+
+There is one writer. Each write bumps the sequence number to odd, writes its
+quotes and bumps it back to even, and a reader copies the slots in use and
+keeps the copy only if the sequence number was the same even number before
+and after, as a seqlock does. This relies on the other processes seeing the
+writes to shared memory in the order they were made, as they do on x86.
+"""
+import struct
+import time
+from multiprocessing import shared_memory
+
+HEADER = struct.Struct('<QQ')
+SEQUENCE = struct.Struct('<Q')
+USED_OFFSET = 8
+NAME_SIZE = 16  # Longest currency name in bytes
+SLOT = struct.Struct('<{0}s{0}sqd'.format(NAME_SIZE))
+VALUE = struct.Struct('<qd')
+VALUE_OFFSET = 32  # bytes from the start of a slot to its timestamp
+
+
+class QuoteTable(object):
+    """
+    Shared memory table of the latest quote of each cross. The process that
+    creates it writes to it, and others attach to it by name to read it.
+
+    >>> writer = QuoteTable(capacity=4)
+    >>> writer.write([(1, 'GBP', 'USD', 1.25), (1, 'USD', 'JPY', 100.0)])
+    >>> reader = QuoteTable(writer.name)
+    >>> reader.changes()
+    [(1, 'GBP', 'USD', 1.25), (1, 'USD', 'JPY', 100.0)]
+    >>> writer.write([(2, 'USD', 'JPY', 101.0)])
+    >>> reader.changes()
+    [(2, 'USD', 'JPY', 101.0)]
+    >>> writer.write([(3, 'JPY', 'USD', 0.0098)])
+    >>> reader.changes()
+    [(3, 'JPY', 'USD', 0.0098)]
+    >>> writer.write([(4, 'USD', 'JPY', 102.0),
+    ...               (4, 'USD@LONDON-EXCHANGE', 'USD', 1.0)])
+    Traceback (most recent call last):
+    ...
+    ValueError: currency name longer than 16 bytes: USD@LONDON-EXCHANGE/USD
+    >>> reader.changes()
+    []
+    >>> writer.write([(5, 'EUR', 'USD', 1.1), (5, 'EUR', 'JPY', 112.0),
+    ...               (5, 'EUR', 'GBP', 0.9)])
+    Traceback (most recent call last):
+    ...
+    ValueError: quote table is full
+    >>> reader.changes()
+    []
+    >>> reader.close()
+    >>> writer.close()
+    """
+    def __init__(self, name=None, capacity=1024):
+        """
+        Creates a new table, or attaches to an existing one
+        :param name: Name of the shared memory of the table to attach to, a
+                     new table is created if not given
+        :param capacity: Most crosses a new table can hold
+        """
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(
+            name, create=self.owner, size=HEADER.size + capacity * SLOT.size)
+        self.name = self.memory.name
+        self.buffer = self.memory.buf
+        self.capacity = (self.memory.size - HEADER.size) // SLOT.size
+        self.sequence = 0  # Sequence number of the last write or read
+        self.slots = {}  # Slot of each cross written, both ways round
+        self.orders = []  # Cross as last written to each slot
+        self.names = {}  # Cross by the encoded names read
+        self.seen = []  # Timestamp of each slot when last read
+
+    def write(self, quotes):
+        """
+        Writes quotes, which readers see all or none of. The whole batch is
+        checked before any of it is written, so a batch that does not fit is
+        refused without readers seeing part of it.
+        :param quotes: Iterable of (microseconds since the epoch, currency 1,
+                       currency 2, price) quotes, any newer than the ones
+                       they replace, with at most one quote of each cross
+        :return: None
+        :raises ValueError: if the table has no room for a new cross, or a
+                            currency name is longer than NAME_SIZE bytes
+        """
+        slots = self.slots
+        orders = self.orders
+        used = len(orders)
+        writes = []  # (slot, cross, encoded names or None, micros, price)
+        for micros, c1, c2, price in quotes:
+            cross = (c1, c2)
+            slot = slots.get(cross)
+            if slot is not None and orders[slot] == cross:
+                writes.append((slot, cross, None, micros, price))
+                continue
+            names = c1.encode('utf-8'), c2.encode('utf-8')
+            if max(len(names[0]), len(names[1])) > NAME_SIZE:
+                raise ValueError('currency name longer than {} bytes: '
+                                 '{}/{}'.format(NAME_SIZE, c1, c2))
+            if slot is None:
+                if used == self.capacity:
+                    raise ValueError('quote table is full')
+                slot = used
+                used += 1
+            writes.append((slot, cross, names, micros, price))
+
+        buffer = self.buffer
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self.sequence)
+        for slot, cross, names, micros, price in writes:
+            offset = HEADER.size + slot * SLOT.size
+            if names is None:
+                VALUE.pack_into(buffer, offset + VALUE_OFFSET, micros, price)
+                continue
+            SLOT.pack_into(buffer, offset, *names, micros, price)
+            if slot == len(orders):
+                slots[cross] = slots[cross[::-1]] = slot
+                orders.append(cross)
+            else:
+                orders[slot] = cross
+        SEQUENCE.pack_into(buffer, USED_OFFSET, used)
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self.sequence)
+
+    def read(self):
+        """
+        Copies the slots in use as they were between two writes, trying
+        again while a write is in progress or if one happened meanwhile
+        :return: Sequence number and the bytes of the slots in use
+        """
+        buffer = self.buffer
+        while True:
+            before = SEQUENCE.unpack_from(buffer, 0)[0]
+            if not before & 1:
+                used = SEQUENCE.unpack_from(buffer, USED_OFFSET)[0]
+                end = HEADER.size + used * SLOT.size
+                data = bytes(buffer[HEADER.size:end])
+                if SEQUENCE.unpack_from(buffer, 0)[0] == before:
+                    return before, data
+            # Lets the writer finish if it shares the CPU
+            time.sleep(0)
+
+    def changes(self):
+        """
+        Gets the quotes written since the last call, from a consistent copy
+        of the table
+        :return: List of (microseconds since the epoch, currency 1, currency
+                 2, price) quotes, in the order their crosses were first
+                 quoted
+        """
+        sequence, data = self.read()
+        if sequence == self.sequence:
+            return []
+        self.sequence = sequence
+        names = self.names
+        seen = self.seen
+        seen.extend([None] * (len(data) // SLOT.size - len(seen)))
+        changed = []
+        for slot, (c1, c2, micros, price) in enumerate(SLOT.iter_unpack(data)):
+            if seen[slot] != micros:
+                seen[slot] = micros
+                cross = names.get((c1, c2))
+                if cross is None:
+                    cross = names[(c1, c2)] = (
+                        c1.rstrip(b'\0').decode('utf-8'),
+                        c2.rstrip(b'\0').decode('utf-8'))
+                changed.append((micros, *cross, price))
+        return changed
+
+    def close(self):
+        """
+        Detaches from the table, and frees it if this is the table that
+        created it
+        :return: None
+        """
+        self.buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
@@ -0,0 +1,168 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+
+Replays capture files through the subscriber's pipeline as fast as possible
+and reports its throughput and latency, and synthesizes large captures with
+the publisher's random walk. For example:
+
+    python replay.py synthesize feed.cap --currencies 30 --datagrams 100000
+    python replay.py run feed.cap --engine compact
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+from itertools import product
+from string import ascii_uppercase
+
+import capture
+import clock
+import event_sink
+import forex_provider
+import fxp_bytes
+from lab3 import ENGINES, Lab3
+
+
+def synthetic_reference(count):
+    """
+    Makes up starting prices against USD for count currencies, beginning with
+    the ones the publisher normally quotes
+    :param count: Number of currencies
+    :return: Dictionary of price by currency
+    """
+    reference = {'GBP': 1.25, 'JPY': 100.0, 'EUR': 1.10, 'CHF': 1.00,
+                 'AUD': 0.75}
+    reference = dict(list(reference.items())[:count])
+    for letters in product(ascii_uppercase, repeat=3):
+        if len(reference) >= count:
+            break
+        code = ''.join(letters)
+        # USD is the other side of every cross and CAD is only used for the
+        # 4-way arbitrage
+        if code not in reference and code not in ('USD', 'CAD'):
+            reference[code] = round(random.uniform(0.5, 150.0), 5)
+    return reference
+
+
+def synthesize(path, currencies=5, datagrams=10000, arbitrage_rate=0.05,
+               interval=0.001, seed=0):
+    """
+    Writes a capture of a synthetic feed, using TestPublisher to random walk
+    the prices. Time is simulated rather than waited for, starting at
+    midnight on 1 January 2020 with one message every interval seconds.
+    :param path: Path of the capture file to write
+    :param currencies: Number of currencies quoted against USD
+    :param datagrams: Number of messages to publish
+    :param arbitrage_rate: Chance of putting an arbitrage in each message
+    :param interval: Simulated seconds between messages
+    :param seed: Seed for the random walk
+    :return: None
+    """
+    random.seed(seed)
+    publisher = forex_provider.TestPublisher(synthetic_reference(currencies),
+                                             arbitrage_rate, verbose=False)
+    publisher.socket.close()
+    writer = capture.CaptureWriter(path)
+    start = clock.utc_micros(datetime(2020, 1, 1))
+    step = clock.seconds_to_micros(interval)
+    for i in range(datagrams):
+        ts = start + i * step
+        quotes = publisher.next_quotes(ts)
+        for quote in quotes:
+            quote.setdefault('timestamp', ts)
+        received = ts + 100  # 100us on the wire
+        for j in range(0, len(quotes), fxp_bytes.MAX_QUOTES_PER_MESSAGE):
+            message = fxp_bytes.marshal_message(
+                quotes[j:j + fxp_bytes.MAX_QUOTES_PER_MESSAGE])
+            writer.write(message, received)
+    writer.close()
+
+
+def percentile(ordered, fraction):
+    """
+    Picks a percentile out of sorted values
+    :param ordered: Sorted list of values
+    :param fraction: Percentile wanted, as a fraction
+    :return: The value at that percentile
+    """
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def replay(path, engine='dict', stale_after=1.5):
+    """
+    Runs every datagram of a capture through Lab3 as it would have arrived,
+    without printing: stale removal, decoding, the out-of-sequence check,
+    graph update and the search with its gating and the tracking of open
+    cycles. Lab3 runs on a ManualClock set to the receive times in the
+    capture, so stale quotes expire as they did when the capture was made,
+    and writes to a sink that only counts events.
+    :param path: Path of the capture file
+    :param engine: Name of the graph class in lab3.ENGINES
+    :param stale_after: Seconds after which a quote is stale
+    :return: Dictionary of counts, the total elapsed seconds and the sorted
+             per-datagram latencies in seconds
+    """
+    replay_clock = clock.ManualClock()
+    sink = event_sink.CountingSink()
+    subscriber = Lab3(engine, stale_after, sink=sink,
+                      clock_source=replay_clock)
+    datagrams = 0
+    latencies = []
+    for received, data in capture.read_capture(path):
+        start = time.perf_counter()
+        replay_clock.set(received)
+        subscriber.remove_stale_quotes()
+        subscriber.iterate_through_data(data)
+        subscriber.run_bellman()
+        latencies.append(time.perf_counter() - start)
+        datagrams += 1
+    counts = sink.counts
+    return {'datagrams': datagrams, 'quotes': counts['quote'],
+            'out_of_sequence': counts['ignored'], 'stale': counts['stale'],
+            'cycles': counts['arbitrage'], 'elapsed': sum(latencies),
+            'latencies': sorted(latencies)}
+
+
+def report(stats):
+    """
+    Prints the results of a replay
+    :param stats: Result of replay
+    :return: None
+    """
+    elapsed = stats['elapsed'] or float('Inf')
+    latencies = stats['latencies'] or [0]
+    print('{datagrams} datagrams, {quotes} quotes, {out_of_sequence} out of '
+          'sequence, {stale} stale removals, {cycles} arbitrage reported'
+          .format(**stats))
+    print('{:,.0f} quotes/sec, {:,.0f} datagrams/sec'.format(
+        stats['quotes'] / elapsed, stats['datagrams'] / elapsed))
+    print('latency us: p50 {:.1f}  p90 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+        *(percentile(latencies, fraction) * 1e6
+          for fraction in (0.5, 0.9, 0.99, 1.0))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Feed capture tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    make = commands.add_parser('synthesize', help='write a synthetic capture')
+    make.add_argument('path')
+    make.add_argument('--currencies', type=int, default=5)
+    make.add_argument('--datagrams', type=int, default=10000)
+    make.add_argument('--arbitrage-rate', type=float, default=0.05)
+    make.add_argument('--interval', type=float, default=0.001,
+                      help='simulated seconds between messages')
+    make.add_argument('--seed', type=int, default=0)
+    run = commands.add_parser('run', help='replay a capture')
+    run.add_argument('path')
+    run.add_argument('--engine', choices=sorted(ENGINES), default='dict')
+    run.add_argument('--stale-after', type=float, default=1.5)
+    args = parser.parse_args()
+
+    if args.command == 'synthesize':
+        synthesize(args.path, args.currencies, args.datagrams,
+                   args.arbitrage_rate, args.interval, args.seed)
+    else:
+        report(replay(args.path, args.engine, args.stale_after))
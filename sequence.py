@@ -0,0 +1,98 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Ruifeng Wang
+:Version: Fall2020
+
+Out-of-sequence filtering of quotes, cross by cross. UDP can deliver an older
+quote after a newer one, and the older one must not overwrite the newer price.
+That only applies within a cross though: a quote is stale for its own cross,
+not because some other cross was quoted later. A cross is the same either way
+round, as GBP/USD and USD/GBP quotes set the same pair of edges.
+"""
+from array import array
+
+
+class SequenceFilter(object):
+    """
+    Latest accepted timestamp of every cross, kept in an array indexed by a
+    small integer id given to each cross the first time it is seen, either
+    way round
+
+    >>> sequence = SequenceFilter()
+    >>> sequence.accept(200, 'GBP', 'USD'), sequence.accept(100, 'USD', 'JPY')
+    (True, True)
+    >>> sequence.accept(150, 'GBP', 'USD'), sequence.accept(150, 'USD', 'JPY')
+    (False, True)
+    >>> sequence.accept(180, 'USD', 'GBP'), sequence.accept(210, 'USD', 'GBP')
+    (False, True)
+    >>> sequence.dropped, sequence.drops_of('GBP', 'USD')
+    (2, 2)
+    """
+    def __init__(self):
+        self.ids = {}  # Cross id by (currency 1, currency 2), both ways round
+        self.latest = array('q')  # Microseconds of the last accepted quote
+        self.drops = array('Q')  # Out-of-sequence quotes dropped by cross
+        self.dropped = 0
+
+    def cross_id(self, c1, c2):
+        """
+        Gets the id of a cross, giving it the next one if it is new in
+        either order
+        :param c1: Currency 1
+        :param c2: Currency 2
+        :return: Index of the cross in latest and drops
+        """
+        cross = (c1, c2)
+        i = self.ids.get(cross)
+        if i is None:
+            i = self.ids[cross] = self.ids[(c2, c1)] = len(self.latest)
+            self.latest.append(-1)
+            self.drops.append(0)
+        return i
+
+    def advance(self, micros, c1, c2):
+        """
+        Records a timestamp as the latest of its cross if it is newer, without
+        counting anything when it is not
+        :param micros: Timestamp in microseconds since the epoch
+        :param c1: Currency 1
+        :param c2: Currency 2
+        :return: True if the timestamp is newer than the latest of its cross
+        """
+        i = self.ids.get((c1, c2))
+        if i is None:
+            i = self.cross_id(c1, c2)
+        if micros > self.latest[i]:
+            self.latest[i] = micros
+            return True
+        return False
+
+    def accept(self, micros, c1, c2):
+        """
+        Checks a quote against the last one accepted for its cross, recording
+        it as the latest if it is newer and counting a drop if not
+        :param micros: Timestamp of the quote in microseconds since the epoch
+        :param c1: Currency 1
+        :param c2: Currency 2
+        :return: True if the quote is newer than any accepted for its cross
+        """
+        i = self.ids.get((c1, c2))
+        if i is None:
+            i = self.cross_id(c1, c2)
+        if micros > self.latest[i]:
+            self.latest[i] = micros
+            return True
+        self.drops[i] += 1
+        self.dropped += 1
+        return False
+
+    def drops_of(self, c1, c2):
+        """
+        Gets the number of quotes of a cross dropped as out of sequence
+        :param c1: Currency 1
+        :param c2: Currency 2
+        :return: Number of quotes dropped
+        """
+        i = self.ids.get((c1, c2))
+        return 0 if i is None else self.drops[i]